@@ -0,0 +1,76 @@
+# ✅ 持ち出し履歴の分析（延滞・稼働率・現場別の持ち出し量）
+# --- CheckoutLog は追記が基本なので、前回から増えた行だけを集計に足していく ---
+
+from dataclasses import dataclass
+
+import pandas as pd
+
+
+@dataclass
+class AnalyticsReport:
+    overdue: pd.DataFrame
+    utilization: pd.DataFrame
+    top_sites: pd.DataFrame
+
+
+class CheckoutStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rows = 0
+        self.first_id = None
+        self.last_id = None
+        self.first_date = pd.NaT
+        self.item_days = pd.Series(dtype='float64')
+        self.site_volume = pd.DataFrame(columns=['持ち出し件数', '持ち出し数合計'], dtype='int64')
+
+    def update(self, checkout):
+        # 集計済みの行がそのまま先頭に残っていれば追記分だけ、そうでなければ全件を集計し直す
+        ids = checkout['ログID'].astype(str)
+        unchanged = (
+            self.rows <= len(checkout) and self.rows > 0
+            and ids.iloc[0] == self.first_id and ids.iloc[self.rows - 1] == self.last_id
+        )
+        if not unchanged:
+            self.reset()
+        new_rows = checkout.iloc[self.rows:]
+        if new_rows.empty:
+            return
+
+        start = pd.to_datetime(new_rows['持ち出し開始日'], errors='coerce')
+        end = pd.to_datetime(new_rows['持ち出し終了日'], errors='coerce')
+        qty = pd.to_numeric(new_rows['持ち出し数'], errors='coerce').fillna(0)
+        days = ((end - start).dt.days + 1).clip(lower=1)
+        item_days = (qty * days).groupby(new_rows['品物ID'].astype(str)).sum()
+        self.item_days = self.item_days.add(item_days, fill_value=0)
+
+        sites = pd.DataFrame({'持ち出し件数': 1, '持ち出し数合計': qty.astype('int64')}).groupby(new_rows['持ち出し先']).sum()
+        self.site_volume = self.site_volume.add(sites, fill_value=0).astype('int64')
+
+        if start.notna().any():
+            self.first_date = min(d for d in (self.first_date, start.min()) if pd.notna(d))
+        self.rows = len(checkout)
+        self.first_id = ids.iloc[0]
+        self.last_id = ids.iloc[-1]
+
+    def report(self, items, active, today, top_n=10):
+        # active: 日付変換済みの持ち出し中の行（開始日・終了日 列つき）
+        late = active[active['終了日'] < today]
+        overdue = late.assign(延滞日数=(today - late['終了日']).dt.days).sort_values('延滞日数', ascending=False)
+        overdue = overdue[['ログID', '品物ID', '品物名', '持ち出し数', '持ち出し先', '持ち出し者',
+                           '持ち出し開始日', '持ち出し終了日', '延滞日数']]
+
+        # 延滞中の行は終了日を過ぎた分も使用中として足す
+        extra = (overdue['持ち出し数'] * overdue['延滞日数']).groupby(overdue['品物ID'].astype(str)).sum()
+        item_days = self.item_days.add(extra, fill_value=0)
+        span = max((today - self.first_date).days + 1, 1) if pd.notna(self.first_date) else 1
+        utilization = items[['品物ID', '品物名', '詳細', '元の在庫数']].copy()
+        utilization['延べ持ち出し日数'] = utilization['品物ID'].map(item_days).fillna(0).astype(int)
+        capacity = (utilization['元の在庫数'] * span).where(utilization['元の在庫数'] > 0)
+        utilization['稼働率'] = (utilization['延べ持ち出し日数'] / capacity).fillna(0).round(3)
+        utilization = utilization.sort_values('稼働率', ascending=False).reset_index(drop=True)
+
+        top_sites = (self.site_volume.sort_values('持ち出し数合計', ascending=False)
+                     .head(top_n).rename_axis('持ち出し先').reset_index())
+        return AnalyticsReport(overdue=overdue.reset_index(drop=True), utilization=utilization, top_sites=top_sites)
@@ -0,0 +1,60 @@
+# ✅ 日付範囲の空き在庫（予約対応）
+# --- 品物ごとに持ち出し期間を掃引線で段差関数にし、区間最大値を疎テーブルで O(1) に引く ---
+
+import numpy as np
+import pandas as pd
+
+OPEN_END = np.datetime64('2200-01-01')
+
+
+def build_intervals(active, today):
+    # active: 持ち出し中の行（品物ID・持ち出し数・持ち出し開始日・持ち出し終了日）
+    # 終了日を過ぎても返っていない行・終了日のない行は、いつ戻るか分からないので期限なしとみなす
+    today = pd.Timestamp(today).normalize()
+    start = pd.to_datetime(active['持ち出し開始日'], errors='coerce').fillna(today)
+    end = pd.to_datetime(active['持ち出し終了日'], errors='coerce')
+    open_ended = end.isna() | (end < today)
+    return pd.DataFrame({
+        '品物ID': active['品物ID'].astype(str),
+        '数量': pd.to_numeric(active['持ち出し数'], errors='coerce').fillna(0).astype(int),
+        '開始日': start.values.astype('datetime64[D]'),
+        '終了日': np.where(open_ended, OPEN_END, end.values.astype('datetime64[D]')).astype('datetime64[D]'),
+    })
+
+
+class SparseMax:
+    def __init__(self, values):
+        self.table = [np.asarray(values)]
+        step = 1
+        while step * 2 <= len(values):
+            prev = self.table[-1]
+            self.table.append(np.maximum(prev[:-step], prev[step:]))
+            step *= 2
+
+    def query(self, lo, hi):
+        k = int(hi - lo + 1).bit_length() - 1
+        return max(self.table[k][lo], self.table[k][hi - (1 << k) + 1])
+
+
+class AvailabilityIndex:
+    def __init__(self, intervals):
+        # 品物ごとに (区切り日の配列, 各区間の使用数の疎テーブル) を持つ。区間 i は [区切り日[i], 区切り日[i+1])
+        self._items = {}
+        for item_id, group in intervals.groupby('品物ID'):
+            points = np.concatenate([group['開始日'].values, group['終了日'].values + np.timedelta64(1, 'D')])
+            deltas = np.concatenate([group['数量'].values, -group['数量'].values])
+            bounds, inverse = np.unique(points, return_inverse=True)
+            levels = np.cumsum(np.bincount(inverse, weights=deltas)).astype(int)
+            self._items[item_id] = (bounds, SparseMax(levels))
+
+    def peak(self, item_id, start, end):
+        # start〜end（両端含む）の間で同時に使われる最大数
+        entry = self._items.get(str(item_id))
+        if entry is None:
+            return 0
+        bounds, table = entry
+        lo = np.searchsorted(bounds, np.datetime64(pd.Timestamp(start).date()), side='right') - 1
+        hi = np.searchsorted(bounds, np.datetime64(pd.Timestamp(end).date()), side='right') - 1
+        if hi < 0:
+            return 0
+        return max(0, int(table.query(max(lo, 0), hi)))
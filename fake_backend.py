@@ -0,0 +1,147 @@
+# ✅ 偽のスプレッドシート（負荷試験・動作確認用）
+# --- SheetsBackend と同じ呼び出し口をメモリ上の表で実装し、API の待ち時間を sleep で再現する ---
+
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+from inventory_service import (CHECKOUT_COLUMNS, CHECKOUT_SHEET, FAVORITE_COLUMNS, FAVORITE_SHEET,
+                               ITEMS_SHEET, LIST_SHEET, META_COLUMNS, META_SHEET, new_revision)
+
+ITEM_NAMES = ['電動ドリル', 'インパクトドライバー', 'ディスクグラインダー', '丸ノコ', 'カッター', '脚立', '延長コード',
+              'コンベックス', 'レーザー墨出し器', '水平器', '投光器', '発電機', 'ハンマー', 'バール', '台車']
+MAKERS = ['マキタ', 'HiKOKI', 'パナソニック', 'ボッシュ', 'タジマ', 'OLFA', 'ハタヤ']
+
+
+def demo_tables(items=300, sites=20, checkouts=200, seed=0):
+    # 品物名は少数の種類に偏らせ、詳細で区別する実際のシートに近い形にする
+    rng = random.Random(seed)
+    item_rows = [[i, rng.choice(ITEM_NAMES), f"{rng.choice(MAKERS)} {rng.randint(1, 99)}型", rng.randint(1, 30)]
+                 for i in range(1, items + 1)]
+    people = [f"作業員{i:02d}" for i in range(1, sites + 1)]
+    list_rows = [[f"現場{i:02d}", people[i - 1]] for i in range(1, sites + 1)]
+    log_rows = []
+    for log_id in range(1, checkouts + 1):
+        item = rng.choice(item_rows)
+        site, person = rng.choice(list_rows)
+        day = rng.randint(1, 28)
+        log_rows.append([log_id, item[0], item[1], 1, site, person, f"2026-01-{day:02d}", f"2026-02-{day:02d}",
+                         'TRUE' if rng.random() < 0.8 else 'FALSE', ''])
+    favorite_rows = [[site, rng.choice(item_rows)[0], rng.randint(1, 3), '定期整備'] for site, _ in list_rows]
+    return {
+        ITEMS_SHEET: [['品物ID', '品物名', '詳細', '元の在庫数']] + item_rows,
+        CHECKOUT_SHEET: [list(CHECKOUT_COLUMNS)] + log_rows,
+        LIST_SHEET: [['持ち出し先', '持ち出し者']] + list_rows,
+        FAVORITE_SHEET: [list(FAVORITE_COLUMNS)] + favorite_rows,
+    }
+
+
+class FakeSheetsBackend:
+    def __init__(self, tables=None, latency=0.0, jitter=0.0, seed=None):
+        # latency 秒（± jitter 秒）を 1 回の API 呼び出しごとに待つ
+        self.tables = tables if tables is not None else demo_tables()
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        if delay:
+            time.sleep(delay)
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = Counter()
+
+    def read_records(self, name):
+        self._call('read_records')
+        with self._lock:
+            header, *rows = self.tables[name]
+            return [dict(zip(header, row + [''] * (len(header) - len(row)))) for row in rows]
+
+    def read_column(self, name, col):
+        self._call('read_column')
+        with self._lock:
+            return [row[col - 1] if len(row) >= col else '' for row in self.tables[name]]
+
+    def read_columns(self, name, cols):
+        self._call('read_columns')
+        with self._lock:
+            return [[row[col - 1] if len(row) >= col else '' for row in self.tables[name]] for col in cols]
+
+    def append_rows(self, name, rows):
+        # SheetsBackend と同じく、追記した最初の行番号を返す
+        self._call('append_rows')
+        with self._lock:
+            first = len(self.tables[name]) + 1
+            self.tables[name].extend(list(row) for row in rows)
+            return first
+
+    def ensure_worksheet(self, name, header):
+        with self._lock:
+            if name in self.tables:
+                return
+        self._call('add_worksheet')
+        with self._lock:
+            self.tables.setdefault(name, [list(header)])
+
+    def read_revision(self):
+        self._call('read_revision')
+        with self._lock:
+            rows = self.tables.get(META_SHEET, [])
+            return rows[1][0] if len(rows) > 1 and rows[1] else ''
+
+    def bump_revision(self):
+        self._call('bump_revision')
+        token = new_revision()
+        with self._lock:
+            self.tables.setdefault(META_SHEET, [list(META_COLUMNS)])[1:] = [[token]]
+        return token
+
+    def batch_update(self, updates):
+        if not any(updates.values()):
+            return
+        self._call('batch_update')
+        with self._lock:
+            for name, cells in updates.items():
+                for row, col, value in cells:
+                    line = self.tables[name][row - 1]
+                    line.extend([''] * (col - len(line)))
+                    line[col - 1] = value
+
+    def replace_all(self, name, header, rows):
+        self._call('replace_all')
+        with self._lock:
+            self.tables[name] = [list(header)] + [list(row) for row in rows]
+
+
+# --- アプリ（ZAIKOKANRI_BACKEND=fake）と負荷試験が同じ偽シートを見るよう、プロセス内で共有する ---
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_backend(name):
+    with _shared_lock:
+        if name not in _shared:
+            _shared[name] = FakeSheetsBackend(
+                demo_tables(items=int(os.getenv('ZAIKOKANRI_FAKE_ITEMS', '300'))),
+                latency=float(os.getenv('ZAIKOKANRI_FAKE_LATENCY', '0')),
+                jitter=float(os.getenv('ZAIKOKANRI_FAKE_JITTER', '0')),
+            )
+        return _shared[name]
+
+
+def shared_backends():
+    with _shared_lock:
+        return dict(_shared)
+
+
+def reset_shared():
+    with _shared_lock:
+        _shared.clear()
@@ -0,0 +1,124 @@
+# ✅ あいまい検索（表記ゆれ・入力ミス対応）
+# --- 読み仮名と詳細を正規化し、2文字ずつ（bi-gram）の一致度と入力ミスを許した部分一致で候補を順位付けする ---
+
+import re
+import time
+import unicodedata
+
+import numpy as np
+
+KATA_TO_HIRA = str.maketrans({chr(c): chr(c - 0x60) for c in range(ord('ァ'), ord('ヶ') + 1)})
+SMALL_TO_LARGE = str.maketrans('ぁぃぅぇぉっゃゅょゎゕゖ', 'あいうえおつやゆよわかけ')
+
+
+def normalize_text(text):
+    # NFKC で全角英数・半角カナを揃え、カタカナ→ひらがな、小書き文字・長音・空白の違いを無視する
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    text = text.translate(KATA_TO_HIRA).translate(SMALL_TO_LARGE)
+    return re.sub(r'[\sー\-‐・]+', '', text)
+
+
+def ngrams(text, n=2):
+    padded = f"^{text}$"
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class _Field:
+    # 1 つの列（読み仮名・詳細）の bi-gram の転置インデックスと、入力ミスの距離を測るための文字の表
+    def __init__(self, texts):
+        texts = [normalize_text(t) for t in texts]
+        docs = [ngrams(t) for t in texts]
+        vocab = {}
+        postings = []
+        for doc_id, grams in enumerate(docs):
+            for gram in grams:
+                gram_id = vocab.setdefault(gram, len(vocab))
+                if gram_id == len(postings):
+                    postings.append([])
+                postings[gram_id].append(doc_id)
+        self.vocab = vocab
+        self.offsets = np.cumsum([0] + [len(p) for p in postings])
+        self.doc_ids = np.fromiter((d for p in postings for d in p), dtype=np.int32, count=int(self.offsets[-1]))
+        self.doc_len = np.array([len(g) for g in docs], dtype=np.float64)
+        self.size = len(docs)
+        # 品物ごとの文字コードを横に並べた表（短い文字列の後ろは 0）
+        self.lengths = np.array([len(t) for t in texts], dtype=np.int64)
+        self.chars = np.zeros((len(texts), int(self.lengths.max(initial=0))), dtype=np.int32)
+        for row, text in enumerate(texts):
+            self.chars[row, :len(text)] = [ord(c) for c in text]
+
+    def overlap(self, grams):
+        ids = [self.vocab[g] for g in grams if g in self.vocab]
+        if not ids:
+            return np.zeros(self.size)
+        hits = np.concatenate([self.doc_ids[self.offsets[i]:self.offsets[i + 1]] for i in ids])
+        return np.bincount(hits, minlength=self.size).astype(np.float64)
+
+    def distance(self, text):
+        # text と、品物の文字列の中のいちばん近い部分との編集距離（挿入・削除・置き換えを 1 文字 1 回と数える）。
+        # 品物の文字の位置ごとに、全品物の分をまとめて 1 列ずつ進める
+        codes = [ord(c) for c in text]
+        column = np.tile(np.arange(len(codes) + 1), (self.size, 1))
+        best = np.full(self.size, len(codes))
+        for j in range(self.chars.shape[1]):
+            differs = self.chars[:, j, None] != np.array(codes)
+            column_next = np.empty_like(column)
+            column_next[:, 0] = 0
+            for i in range(1, len(codes) + 1):
+                column_next[:, i] = np.minimum(np.minimum(column[:, i], column_next[:, i - 1]) + 1,
+                                               column[:, i - 1] + differs[:, i - 1])
+            column = column_next
+            best = np.where(j < self.lengths, np.minimum(best, column[:, -1]), best)
+        return best
+
+
+class FuzzyIndex:
+    def __init__(self, yomi, detail):
+        # 読み仮名と詳細は別々に索引を作って別々に採点する（片方の語の頭ともう片方の語の終わりが足し合わされないように）
+        self.fields = [_Field(yomi), _Field(detail)]
+        self.size = self.fields[0].size
+
+    def _keyword_score(self, variants):
+        # 読み仮名に変換した形と入力そのままの形、読み仮名と詳細のうち、いちばんよく一致した組み合わせを採用する。
+        # 一致度 = 0.7 × max(bi-gram の網羅率, 入力ミスを許した一致) + 0.3 × Dice 係数。
+        # 入力ミスは 3〜5 文字で 1 文字、6〜8 文字で 2 文字まで許す（2 文字以下は部分一致のみ）
+        best = np.zeros(self.size)
+        for text in variants:
+            text = normalize_text(text)
+            if not text:
+                continue
+            grams = ngrams(text)
+            allowed = len(text) // 3
+            for field in self.fields:
+                overlap = field.overlap(grams)
+                coverage = overlap / len(grams)
+                dice = 2 * overlap / (len(grams) + field.doc_len)
+                if allowed:
+                    distance = field.distance(text)
+                    coverage = np.maximum(coverage, np.where(distance <= allowed, 1 - distance / len(text), 0))
+                best = np.maximum(best, 0.7 * coverage + 0.3 * dice)
+        return best
+
+    def search(self, keywords, mode="AND", top_k=30, min_score=0.4, budget_ms=50):
+        # keywords: [(読み仮名, 入力そのまま), ...]。戻り値は (行位置, 一致度, 全キーワードを見たか)。行位置は一致度の高い順
+        started = time.perf_counter()
+        scores = None
+        complete = True
+        for n, variants in enumerate(keywords, 1):
+            score = self._keyword_score(variants)
+            if scores is None:
+                scores = score
+            else:
+                scores = np.minimum(scores, score) if mode == "AND" else np.maximum(scores, score)
+            # 時間予算を超えたら、そこまでのキーワードで打ち切る
+            if n < len(keywords) and (time.perf_counter() - started) * 1000 > budget_ms:
+                complete = False
+                break
+        if scores is None:
+            return np.array([], dtype=int), np.array([]), complete
+
+        candidates = np.flatnonzero(scores >= min_score)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        order = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return order, scores[order], complete
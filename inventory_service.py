@@ -0,0 +1,1596 @@
+# ✅ 備品管理サービス層（Streamlit 非依存）
+# --- 読込・検索・持ち出し・返却・いつものカートを画面から切り離し、スクリプトやバッチからも呼べるようにする ---
+
+import inspect
+import re
+import sys
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from dataclasses import dataclass, field, replace
+from datetime import date
+from functools import lru_cache, wraps
+
+import gspread
+import numpy as np
+import pandas as pd
+import pykakasi
+
+from analytics import CheckoutStats
+from availability import AvailabilityIndex, build_intervals
+from fuzzy_search import FuzzyIndex
+from low_stock import THRESHOLD_COLUMNS, THRESHOLD_SHEET, LowStockTracker, latest_thresholds
+from stock_history import (EVENT_COLUMNS, EVENT_SHEET, SNAPSHOT_COLUMNS, SNAPSHOT_SHEET, TIME_FORMAT,
+                           StockHistory, now_str)
+
+ITEMS_SHEET = "Items"
+CHECKOUT_SHEET = "CheckoutLog"
+LIST_SHEET = "List"
+FAVORITE_SHEET = "favorite"
+ADJUSTMENT_SHEET = "StockAdjustments"
+META_SHEET = "Meta"
+
+RETURNED_COL = '返却済み（TRUE/FALSE）'
+CHECKOUT_COLUMNS = ['ログID', '品物ID', '品物名', '持ち出し数', '持ち出し先', '持ち出し者',
+                    '持ち出し開始日', '持ち出し終了日', RETURNED_COL, '返却数量']
+FAVORITE_COLUMNS = ['持ち出し先', '品物ID', '数量', 'メモ']
+ADJUSTMENT_COLUMNS = ['日時', '品物ID', '増減', '種別', 'ログID', '備考']
+META_COLUMNS = ['改訂番号']
+SHEETS = [ITEMS_SHEET, CHECKOUT_SHEET, LIST_SHEET, FAVORITE_SHEET]
+DEFAULT_WAREHOUSE = "本倉庫"
+
+# --- ふりがな変換セットアップ ---
+kakasi = pykakasi.kakasi()
+kakasi.setMode("J", "H")
+kakasi.setMode("K", "H")
+kakasi.setMode("H", "H")
+converter = kakasi.getConverter()
+
+
+@lru_cache(maxsize=8192)
+def get_yomi(text):
+    return converter.do(str(text))
+
+
+def is_active(checkout):
+    return checkout[RETURNED_COL].astype(str).str.upper() != 'TRUE'
+
+
+def calculate_remaining_stock(items, checkout, today=None, adjustments=None):
+    # 元の行番号（index）を保ったまま在庫数を計算する
+    # 持ち出し開始日が今日より後の行は「予約中」として、今の残りの在庫数からは引かない
+    # 元の在庫数 = シート上の在庫数（基準の在庫数）+ 在庫調整（破損・滅失・入荷）の合計
+    items = items.drop(columns=['持ち出し中の在庫数', '予約中の在庫数', '残りの在庫数'], errors='ignore').copy()
+    checkout = checkout.copy()
+    items['品物ID'] = items['品物ID'].astype(str)
+    checkout['品物ID'] = checkout['品物ID'].astype(str)
+    if '基準の在庫数' not in items.columns:
+        items['基準の在庫数'] = pd.to_numeric(items['元の在庫数'], errors='coerce').fillna(0).astype(int)
+    adjusted = pd.Series(dtype='int64')
+    if adjustments is not None and not adjustments.empty:
+        deltas = pd.to_numeric(adjustments['増減'], errors='coerce').fillna(0).astype(int)
+        adjusted = deltas.groupby(adjustments['品物ID'].astype(str)).sum()
+    items['元の在庫数'] = items['基準の在庫数'] + items['品物ID'].map(adjusted).fillna(0).astype(int)
+    checkout['持ち出し数'] = pd.to_numeric(checkout['持ち出し数'], errors='coerce').fillna(0).astype(int)
+    not_returned = checkout[is_active(checkout)]
+    today = pd.Timestamp(today or date.today()).normalize()
+    future = pd.to_datetime(not_returned['持ち出し開始日'], errors='coerce') > today
+    checked_out = not_returned[~future].groupby('品物ID')['持ち出し数'].sum()
+    reserved = not_returned[future].groupby('品物ID')['持ち出し数'].sum()
+    items['持ち出し中の在庫数'] = items['品物ID'].map(checked_out).fillna(0).astype(int)
+    items['予約中の在庫数'] = items['品物ID'].map(reserved).fillna(0).astype(int)
+    items['残りの在庫数'] = items['元の在庫数'] - items['持ち出し中の在庫数']
+    return items, checkout
+
+
+def search_items(items, keywords, mode="AND"):
+    # 品物名は読み仮名（3文字以上）、詳細はそのまま（2文字以上）で部分一致
+    keywords = [k for k in keywords if k]
+    matched = pd.Series(False, index=items.index)
+
+    def combine(masks):
+        frame = pd.concat(masks, axis=1)
+        return frame.all(axis=1) if mode == "AND" else frame.any(axis=1)
+
+    yomi_targets = [y for y in (get_yomi(k) for k in keywords) if len(y) >= 3]
+    if yomi_targets:
+        yomi = items['読み仮名']
+        matched |= combine([yomi.str.contains(k, regex=False) for k in yomi_targets])
+
+    detail_targets = [k for k in keywords if len(k) >= 2]
+    if detail_targets:
+        detail = items['詳細'].astype(str)
+        matched |= combine([detail.str.contains(k, regex=False) for k in detail_targets])
+
+    return items[matched]
+
+
+def normalize_keywords(keywords, fuzzy=False):
+    # 並び順・重複の違いは同じ検索とみなす（あいまい検索は全角/半角の違いも同じとみなす）
+    if fuzzy:
+        keywords = (unicodedata.normalize('NFKC', k) for k in keywords)
+    return tuple(sorted({k.strip() for k in keywords} - {''}))
+
+
+BULK_LINE = re.compile(r'^(?P<id>[^\s,*×]+)(?:[\s,*×]+(?P<qty>-?\d+))?$')
+BULK_COLUMNS = ['行', '入力', '品物ID', '数量', '問題']
+
+
+def parse_bulk_entry(text):
+    # 1 行に「品物ID 数量」（区切りは空白・カンマ・タブ・×）。数量のない行は 1 個として数え、
+    # バーコードで同じ品物を続けて読んだ分はあとで合算する
+    rows = []
+    for number, line in enumerate(unicodedata.normalize('NFKC', text or '').splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        match = BULK_LINE.match(line)
+        if match is None:
+            rows.append({'行': number, '入力': line, '品物ID': '', '数量': 0, '問題': "「品物ID 数量」の形で入力してください"})
+        else:
+            qty = int(match['qty']) if match['qty'] else 1
+            rows.append({'行': number, '入力': line, '品物ID': match['id'], '数量': qty,
+                         '問題': '' if qty > 0 else "数量は 1 以上にしてください"})
+    return pd.DataFrame(rows, columns=BULK_COLUMNS)
+
+
+class SearchCache:
+    # プロセス全体で共有する検索結果の LRU。DataFrame ではなく一致した品物ID だけを持つ
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+class RecentSubmissions:
+    # 最近の送信キー → 結果。同じキーの 2 回目以降（ダブルクリック・再実行）はもう一度書き込まずに最初の結果を返す。
+    # 主の書き込みより前で失敗した送信は覚えないので、同じキーでやり直せる。
+    # 主の書き込みの後（改訂番号・履歴など）で失敗した送信は覚えておき、同じキーでやり直したときに残りの処理だけを続ける
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.repeats = 0
+        self._done = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, action):
+        # (結果, 2 回目以降か) を返す。同じキーが処理中なら終わるのを待つ。
+        # action(on_written) は主の書き込みが終わったところで on_written(結果, 続き) を呼ぶ。
+        # 続きは残りの処理を行う関数で、それより後で失敗したら同じキーのやり直しで続きだけを呼ぶ
+        if key is None:
+            return action(lambda result, resume: None), False
+        while True:
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending is None:
+                    entry = self._done.get(key)
+                    if entry is not None and entry[1] is None:
+                        self._done.move_to_end(key)
+                        self.repeats += 1
+                        return entry[0], True
+                    self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+        try:
+            if entry is not None:
+                entry[1]()
+                with self._lock:
+                    entry[1] = None
+                    self.repeats += 1
+                return entry[0], True
+            result = action(lambda written, resume: self._remember(key, written, resume))
+            self._remember(key, result, None)
+            return result, False
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def _remember(self, key, result, resume):
+        with self._lock:
+            self._done[key] = [result, resume]
+            self._done.move_to_end(key)
+            while len(self._done) > self.maxsize:
+                self._done.popitem(last=False)
+
+
+class StockConflictError(ValueError):
+    # 確定直前の在庫確認で足りなくなった行（品物ID, 要求数, 残り）を持つ
+    def __init__(self, shortages):
+        self.shortages = shortages
+        if shortages:
+            ids = ', '.join(str(s['品物ID']) for s in shortages)
+            super().__init__(f"在庫が足りなくなった品物があります: {ids}")
+        else:
+            super().__init__("他の持ち出し登録と重なりました。もう一度確定してください。")
+
+
+class ReturnValidationError(ValueError):
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("返却できない行があります: " + " / ".join(problems))
+
+
+def _active_checkout(snap):
+    # 持ち出し中の行だけを取り出し、日付列を一度だけ日付型に変換しておく
+    active = snap.checkout[is_active(snap.checkout)].copy()
+    active['開始日'] = pd.to_datetime(active['持ち出し開始日'], errors='coerce')
+    active['終了日'] = pd.to_datetime(active['持ち出し終了日'], errors='coerce')
+    return active
+
+
+def _filled_length(values):
+    # 最後に値の入っている行までの行数（ヘッダーを含む）
+    for i in range(len(values) - 1, -1, -1):
+        if str(values[i]).strip() != '':
+            return i + 1
+    return 0
+
+
+def _allowed(lines, items, active):
+    # 各行に割り当てられる数。行の持ち出し期間中に active の行で同時に使われる最大数を引き、
+    # 同じ品物が複数行にある場合は前の行から順に残りを割り当てる
+    index = AvailabilityIndex(build_intervals(active, date.today()))
+    peak = [index.peak(i, s, e) for i, s, e in zip(lines['品物ID'], lines['持ち出し開始日'], lines['持ち出し終了日'])]
+    available = items['元の在庫数'].reindex(lines['品物ID']).to_numpy() - np.array(peak)
+    before = lines.groupby('品物ID')['持ち出し数'].cumsum() - lines['持ち出し数']
+    return (available - before).clip(lower=0).clip(upper=lines['持ち出し数'])
+
+
+def _run_steps(steps):
+    # 終わった処理から外していくので、途中で失敗しても残りの処理だけが steps に残る
+    while steps:
+        steps[0][1]()
+        steps.pop(0)
+
+
+def _log_rows(snap):
+    # ログID → 持ち出しの表の中の位置（同じログID があれば先頭）
+    row_of = pd.Series(snap.checkout.index, index=snap.checkout['ログID'].astype(str))
+    return row_of[~row_of.index.duplicated()]
+
+
+READ_ONLY_MESSAGE = "共有の表は読み取り専用です。copy() か assign() で別の表を作ってから変更してください"
+
+
+class ReadOnlyFrame(pd.DataFrame):
+    # スナップショットの表は全セッションで 1 つを共有するので、列の追加・削除も値の書き換えもさせない。
+    # 絞り込み・assign・copy の結果は普通の DataFrame になる
+    @property
+    def _constructor(self):
+        return pd.DataFrame
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError(READ_ONLY_MESSAGE)
+
+    __setitem__ = __delitem__ = insert = pop = update = _update_inplace = _read_only
+
+    def __setattr__(self, name, value):
+        # df.columns = ... / df.index = ... も表をその場で書き換えるので同じく断る
+        if name in ('columns', 'index'):
+            self._read_only()
+        super().__setattr__(name, value)
+
+    # .loc / .iloc / .at / .iat は読むだけなら今までどおり、代入すると同じエラーにする
+    @property
+    def loc(self):
+        return _ReadOnlyIndexer(super().loc)
+
+    @property
+    def iloc(self):
+        return _ReadOnlyIndexer(super().iloc)
+
+    @property
+    def at(self):
+        return _ReadOnlyIndexer(super().at)
+
+    @property
+    def iat(self):
+        return _ReadOnlyIndexer(super().iat)
+
+
+def _refuse_inplace(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if kwargs.get('inplace'):
+            self._read_only()
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+# inplace=True を受け付けるメソッド（rename・sort_values・drop など）は、inplace=True のときだけ断る
+for _name, _method in inspect.getmembers(pd.DataFrame, inspect.isfunction):
+    if not _name.startswith('_') and 'inplace' in inspect.signature(_method).parameters:
+        setattr(ReadOnlyFrame, _name, _refuse_inplace(_method))
+del _name, _method
+
+
+class _ReadOnlyIndexer:
+    def __init__(self, indexer):
+        self._indexer = indexer
+
+    def __getitem__(self, key):
+        return self._indexer[key]
+
+    def __setitem__(self, key, value):
+        raise TypeError(READ_ONLY_MESSAGE)
+
+    def __getattr__(self, name):
+        return getattr(self._indexer, name)
+
+
+def _read_only(df):
+    return df if df is None or isinstance(df, ReadOnlyFrame) else ReadOnlyFrame(df)
+
+
+def deep_size(obj, _seen=None):
+    # セッションが持つデータのおおよそのバイト数。DataFrame は文字列の中身まで数え、同じオブジェクトは 1 回だけ数える
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(obj, pd.DataFrame) else usage)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v, seen) for v in obj)
+    return size
+
+
+def new_revision():
+    return f"{time.time():.6f}-{uuid.uuid4().hex[:8]}"
+
+
+def _frame(records, columns=None):
+    df = pd.DataFrame(records)
+    if df.empty and columns:
+        df = pd.DataFrame(columns=columns)
+    return df
+
+
+def _date_str(value):
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+# --- Google スプレッドシート接続 ---
+class SheetsBackend:
+    def __init__(self, gc, spreadsheet_name):
+        self.gc = gc
+        self.spreadsheet_name = spreadsheet_name
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._lock = threading.Lock()
+
+    def worksheet(self, name):
+        # open / worksheet 取得も API 呼び出しなので一度だけ行う
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = self.gc.open(self.spreadsheet_name)
+            if name not in self._worksheets:
+                self._worksheets[name] = self._spreadsheet.worksheet(name)
+            return self._worksheets[name]
+
+    def read_records(self, name):
+        return self.worksheet(name).get_all_records()
+
+    def read_column(self, name, col):
+        return self.worksheet(name).col_values(col)
+
+    def read_columns(self, name, cols):
+        # 必要な列だけを 1 回の batch_get で読む（ヘッダー行を含む）
+        letters = [gspread.utils.rowcol_to_a1(1, col).rstrip('0123456789') for col in cols]
+        ranges = self.worksheet(name).batch_get([f"{letter}:{letter}" for letter in letters])
+        columns = [[row[0] if row else '' for row in values] for values in ranges]
+        length = max((len(c) for c in columns), default=0)
+        return [c + [''] * (length - len(c)) for c in columns]
+
+    def append_rows(self, name, rows):
+        # 追記した最初の行番号を返す（同時に追記した他の人の行と区別するため）
+        response = self.worksheet(name).append_rows(rows)
+        match = re.search(r'![A-Z]+(\d+)', (response or {}).get('updates', {}).get('updatedRange', ''))
+        return int(match.group(1)) if match else None
+
+    def ensure_worksheet(self, name, header):
+        # 履歴用など後から増えたシートは、なければヘッダーだけの状態で作る
+        try:
+            return self.worksheet(name)
+        except gspread.WorksheetNotFound:
+            with self._lock:
+                ws = self._spreadsheet.add_worksheet(title=name, rows=1000, cols=len(header))
+                ws.append_row(header)
+                self._worksheets[name] = ws
+                return ws
+
+    def read_revision(self):
+        # 変更の確認用に、改訂番号のセル 1 つだけを読む
+        return self.ensure_worksheet(META_SHEET, META_COLUMNS).acell('A2').value or ''
+
+    def bump_revision(self):
+        # 書き込みのたびに改訂番号を新しい値にする（他のプロセスが変更に気付けるように）
+        token = new_revision()
+        self.ensure_worksheet(META_SHEET, META_COLUMNS).update_acell('A2', token)
+        return token
+
+    def batch_update(self, updates):
+        # updates: {シート名: [(行, 列, 値), ...]} を複数シートまとめて 1 回の API 呼び出しで書き込む
+        data = [
+            {'range': f"'{name}'!{gspread.utils.rowcol_to_a1(row, col)}", 'values': [[value]]}
+            for name, cells in updates.items() for row, col, value in cells
+        ]
+        if not data:
+            return
+        self.worksheet(next(iter(updates)))
+        self._spreadsheet.values_batch_update({'valueInputOption': 'USER_ENTERED', 'data': data})
+
+    def replace_all(self, name, header, rows):
+        ws = self.worksheet(name)
+        ws.clear()
+        ws.append_row(header)
+        if rows:
+            ws.append_rows(rows)
+
+
+@dataclass
+class InventorySnapshot:
+    items: pd.DataFrame
+    checkout: pd.DataFrame
+    lists: pd.DataFrame
+    favorites: pd.DataFrame
+    adjustments: pd.DataFrame
+    thresholds: pd.DataFrame
+    version: int
+    stale_warehouses: list = field(default_factory=list)
+    # 品物の表（品物ID・品物名・読み仮名・詳細）を読み直したときだけ変わる版（持ち出し・返却では変わらない）
+    items_version: int = 0
+    # 発注点以下になっている品物ID（ホーム画面の通知はこの件数を見るだけ）
+    low_stock: frozenset = frozenset()
+
+
+@dataclass
+class CheckoutResult:
+    log_ids: list
+    shortages: list = field(default_factory=list)
+    repeated: bool = False
+
+
+@dataclass
+class GroupIndex:
+    # 品物名ごとの品物ID。names は読み仮名順、position は品物名 → names での位置
+    names: list
+    members: dict
+    name_of: pd.Series
+    position: dict
+
+
+@dataclass
+class BulkEntryResult:
+    additions: dict
+    problems: pd.DataFrame
+
+
+class InventoryService:
+    def __init__(self, backends, ttl=20, search_cache_size=256, load_timeout=15, snapshot_every=200, max_age=600,
+                 shared_cache=None):
+        # backends: バックエンド 1 つ、または {倉庫名: バックエンド}（倉庫ごとのスプレッドシート）
+        # 倉庫が複数のときは 品物ID・ログID を「倉庫名:ID」にして、まとめた表の中で重ならないようにする
+        # shared_cache: 複数のプロセスで動かすときの SharedCache。読み込み結果・改訂番号・読み仮名をプロセス間で共有する
+        if not isinstance(backends, dict):
+            backends = {DEFAULT_WAREHOUSE: backends}
+        self.backends = backends
+        self.multi = len(backends) > 1
+        # ttl 秒ごとに改訂番号だけを確認し、変わった倉庫だけを読み直す。
+        # シートを直接編集した分は改訂番号が変わらないので、max_age 秒たったら全体を読み直す
+        self.ttl = ttl
+        self.max_age = max_age
+        self.load_timeout = load_timeout
+        self.shared_cache = shared_cache
+        self.search_cache = SearchCache(search_cache_size)
+        self.submissions = RecentSubmissions()
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._revisions = {}
+        self._version = 0
+        self._items_version = 0
+        # 読み込みを公開した回数。書き込みの間に読み込みがあったかを反映のときに確かめる
+        self._loads = 0
+        self._item_locks = defaultdict(threading.Lock)
+        self._item_locks_guard = threading.Lock()
+        # 倉庫ごとの書き込みロック。ログID・行番号の採番や、行番号を前提にした書き込みはこの中で行う
+        self._write_locks = {name: threading.Lock() for name in backends}
+        self._derived_cache = {}
+        self._checkout_stats = CheckoutStats()
+        self._low_stock = LowStockTracker()
+        self._analytics = (None, None)
+        self._analytics_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(4, len(backends)), thread_name_prefix="warehouse")
+        self._shards = {}
+        self._headers = {}
+        self._columns = {}
+        self.snapshot_every = snapshot_every
+        self._history = None
+        self._history_lock = threading.RLock()
+        self._history_rows = {}
+        self._history_synced_at = 0.0
+        self._last_stamp = pd.Timestamp.min
+        self._session_memory = {}
+
+    # --- 読込 ---
+    def load(self, names=None):
+        # 倉庫ごとに並行して読み込む。時間内に終わらない倉庫は前回のデータを使い、他の倉庫を待たせない
+        # names を渡すとその倉庫だけを読み直し、他の倉庫は前回読み込んだ内容を使う
+        full = names is None
+        names = list(self.backends) if full else list(names)
+        futures = {}
+        for name in names:
+            future = self._executor.submit(self._read_shard, name)
+            future.add_done_callback(lambda f, name=name: self._store_shard(name, f))
+            futures[name] = future
+        wait(futures.values(), timeout=self.load_timeout)
+
+        current = self._snapshot
+        stale = [] if full or current is None else [n for n in current.stale_warehouses if n not in names]
+        for name, future in futures.items():
+            if future.done() and future.exception() is None:
+                self._store_shard(name, future)
+                continue
+            if name not in self._shards:
+                if not self.multi:
+                    future.result()
+                self._shards[name] = self._empty_shard(name)
+            stale.append(name)
+
+        shards = [self._shards[name] for name in self.backends]
+        frames = {
+            key: pd.concat([shard[key] for shard in shards], ignore_index=True)
+            for key in ['items', 'checkout', 'lists', 'favorites', 'adjustments', 'thresholds']
+        }
+        frames['lists'] = frames['lists'].drop_duplicates(['持ち出し先', '持ち出し者'])
+        with self._lock:
+            now = time.monotonic()
+            if full:
+                self._loaded_at = now
+            self._checked_at = now
+            # 改訂番号は公開するスナップショットに入った倉庫の分だけ覚える。遅れて届いた読み込み結果
+            # （add_done_callback で _shards に入ったもの）は、次の確認で変わった倉庫として読み直して公開する
+            for name in names:
+                if name not in stale:
+                    self._revisions[name] = self._shards[name]['revision']
+            self._loads += 1
+            return self._publish(stale_warehouses=stale, **frames)
+
+    def _read_shard(self, name):
+        if self.shared_cache is None:
+            return self._fetch_shard(name)
+        # 同じ改訂番号の読み込み結果を他のプロセスが持っていればそれを使い、なければ 1 つのプロセスだけが読む
+        key = f"{name}|{'multi' if self.multi else 'single'}"
+        revision = self._poll_revision(name)
+        shard = self.shared_cache.shard(key, revision, self.max_age, lambda: self._fetch_shard(name))
+        if shard['revision'] != revision:
+            # 確認してから読むまでの間に書き込まれていた。読んだ方の改訂番号を共有し、他のプロセスが読み直さずに済むようにする
+            self.shared_cache.put_revision(name, shard['revision'])
+        return shard
+
+    def _fetch_shard(self, name):
+        backend = self.backends[name]
+        # 改訂番号はデータより先に読む（読んでいる途中の書き込みは次の確認で気付く）
+        revision = backend.read_revision()
+        records = {sheet: backend.read_records(sheet) for sheet in SHEETS}
+        items = self._tag(name, _frame(records[ITEMS_SHEET]))
+        checkout = self._tag(name, _frame(records[CHECKOUT_SHEET], CHECKOUT_COLUMNS), log_ids=True)
+        lists = self._tag(name, _frame(records[LIST_SHEET], ['持ち出し先', '持ち出し者']), item_ids=False)
+        favorites = self._tag(name, _frame(records[FAVORITE_SHEET], FAVORITE_COLUMNS))
+        backend.ensure_worksheet(ADJUSTMENT_SHEET, ADJUSTMENT_COLUMNS)
+        adjustments = self._tag(name, _frame(backend.read_records(ADJUSTMENT_SHEET), ADJUSTMENT_COLUMNS))
+        backend.ensure_worksheet(THRESHOLD_SHEET, THRESHOLD_COLUMNS)
+        thresholds = self._tag(name, _frame(backend.read_records(THRESHOLD_SHEET), THRESHOLD_COLUMNS))
+        items = items[items['品物名'].notna() & (items['品物名'] != '')]
+        items = items.assign(読み仮名=self._yomi(items['品物名']))
+        return {
+            'items': items, 'checkout': checkout, 'lists': lists, 'favorites': favorites, 'adjustments': adjustments,
+            'thresholds': thresholds, 'revision': revision,
+            'headers': {ITEMS_SHEET: list(records[ITEMS_SHEET][0]) if records[ITEMS_SHEET] else [],
+                        CHECKOUT_SHEET: list(records[CHECKOUT_SHEET][0]) if records[CHECKOUT_SHEET] else CHECKOUT_COLUMNS,
+                        FAVORITE_SHEET: list(records[FAVORITE_SHEET][0]) if records[FAVORITE_SHEET] else FAVORITE_COLUMNS},
+        }
+
+    def _yomi(self, names):
+        if self.shared_cache is None:
+            return names.map(get_yomi)
+        return names.astype(str).map(self.shared_cache.yomi(names.astype(str).unique(), get_yomi))
+
+    def _store_shard(self, name, future):
+        if future.exception() is None:
+            shard = future.result()
+            self._shards[name] = shard
+            self._headers[name] = shard['headers']
+            # 列番号は読み込みのたびに 1 度だけ引けるようにしておく
+            self._columns[name] = {sheet: {column: i + 1 for i, column in reversed(list(enumerate(header)))}
+                                   for sheet, header in shard['headers'].items()}
+
+    def _empty_shard(self, name):
+        return {
+            'items': self._tag(name, pd.DataFrame(columns=['品物ID', '品物名', '詳細', '元の在庫数', '読み仮名'])),
+            'checkout': self._tag(name, pd.DataFrame(columns=CHECKOUT_COLUMNS), log_ids=True),
+            'lists': self._tag(name, pd.DataFrame(columns=['持ち出し先', '持ち出し者']), item_ids=False),
+            'favorites': self._tag(name, pd.DataFrame(columns=FAVORITE_COLUMNS)),
+            'adjustments': self._tag(name, pd.DataFrame(columns=ADJUSTMENT_COLUMNS)),
+            'thresholds': self._tag(name, pd.DataFrame(columns=THRESHOLD_COLUMNS)),
+        }
+
+    def _tag(self, name, df, item_ids=True, log_ids=False):
+        # 倉庫名とシート上の行番号（ヘッダーが 1 行目）を付ける
+        df = df.copy()
+        df['倉庫'] = name
+        df['行番号'] = df.index + 2
+        if self.multi and item_ids:
+            df['品物ID'] = self._qualify(name, df['品物ID'])
+        if self.multi and log_ids:
+            df['ログID'] = self._qualify(name, df['ログID'])
+        return df
+
+    def _qualify(self, name, values):
+        values = pd.Series(values).astype(str)
+        return name + ':' + values if self.multi else values
+
+    def _raw_id(self, value):
+        return str(value).split(':', 1)[-1] if self.multi else str(value)
+
+    def _sheet_id(self, value):
+        # シートには数値の ID は数値のまま書く
+        raw = self._raw_id(value)
+        return int(raw) if raw.isdigit() else raw
+
+    def _col(self, warehouse, sheet, column):
+        # シート上の列番号（1 始まり）
+        return self._columns[warehouse][sheet][column]
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is None or now - self._loaded_at > self.max_age:
+                return self.load()
+            if now - self._checked_at > self.ttl:
+                self._checked_at = now
+                changed = self._changed_warehouses()
+                if changed:
+                    return self.load(changed)
+            return self._snapshot
+
+    def _changed_warehouses(self):
+        # 倉庫ごとに改訂番号のセル 1 つだけを並行して読み、前回読み込んだときから変わった倉庫を返す
+        futures = {name: self._executor.submit(self._poll_revision, name) for name in self.backends}
+        wait(futures.values(), timeout=self.load_timeout)
+        changed = []
+        for name, future in futures.items():
+            if not future.done() or future.exception() is not None:
+                continue
+            if future.result() != self._revisions.get(name):
+                changed.append(name)
+        return changed
+
+    def _poll_revision(self, name):
+        # 共有キャッシュがあれば、ttl 秒以内にどこかのプロセスが確認した改訂番号を使い、確認は全体で ttl 秒に 1 回にする
+        backend = self.backends[name]
+        if self.shared_cache is None:
+            return backend.read_revision()
+        return self.shared_cache.revision(name, self.ttl, backend.read_revision)
+
+    def _touch(self, warehouses):
+        # 書き込んだ倉庫の改訂番号を進める。進める直前の改訂番号が前回読み込んだときのままなら、
+        # 間に書いた人はいないので自分の改訂番号を覚え、次の確認で自分の書き込みを読み直さない。
+        # 変わっていれば他の人の書き込みがあるので、覚えずに次の確認で読み直す
+        for name in dict.fromkeys(warehouses):
+            backend = self.backends[name]
+            unchanged = backend.read_revision() == self._revisions.get(name)
+            token = backend.bump_revision()
+            if unchanged:
+                with self._lock:
+                    self._revisions[name] = token
+            if self.shared_cache is not None:
+                self.shared_cache.put_revision(name, token)
+
+    def _publish(self, stale_warehouses=None, changed_items=None, **frames):
+        # 既存のスナップショットは書き換えず、差し替え用の新しいスナップショットを作る
+        # changed_items: 数の変わった品物ID。渡されたときは発注点の判定をその品物だけやり直す
+        current = self._snapshot
+        items = frames.get('items', current.items if current else None)
+        checkout = frames.get('checkout', current.checkout if current else None)
+        adjustments = frames.get('adjustments', current.adjustments if current else None)
+        thresholds = frames.get('thresholds', current.thresholds if current else None)
+        if 'items' in frames or 'checkout' in frames or 'adjustments' in frames:
+            items, checkout = calculate_remaining_stock(items, checkout, adjustments=adjustments)
+        if changed_items is not None:
+            low_stock = self._low_stock.update(items, changed_items)
+        elif 'items' in frames or 'checkout' in frames or 'adjustments' in frames or 'thresholds' in frames:
+            low_stock = self._low_stock.rebuild(items, latest_thresholds(thresholds))
+        else:
+            low_stock = current.low_stock
+        self._version += 1
+        if 'items' in frames:
+            self._items_version += 1
+        self._snapshot = InventorySnapshot(
+            items=_read_only(items),
+            checkout=_read_only(checkout),
+            lists=_read_only(frames.get('lists', current.lists if current else None)),
+            favorites=_read_only(frames.get('favorites', current.favorites if current else None)),
+            adjustments=_read_only(adjustments),
+            thresholds=_read_only(thresholds),
+            version=self._version,
+            items_version=self._items_version,
+            stale_warehouses=stale_warehouses if stale_warehouses is not None else current.stale_warehouses,
+            low_stock=low_stock,
+        )
+        return self._snapshot
+
+    def _write_base(self):
+        # 書き込み前のスナップショットと、その時点までの読み込みの回数（倉庫の書き込みロックを取ってから呼ぶ）
+        with self._lock:
+            return self.snapshot(), self._loads
+
+    def _publish_write(self, warehouses, loads, frames):
+        # シートへの書き込みが終わってから、今のスナップショットに書き込んだ分を重ねて公開する（self._lock はこの間だけ持つ）。
+        # frames(current) は current に書き込みを重ねた _publish の引数を返す。
+        # 書き込みの間に読み込みがあった場合は、読み込んだ表に書き込みが入っているか分からないので重ねずに、書き込んだ倉庫を読み直す
+        with self._lock:
+            if self._loads == loads:
+                return self._publish(**frames(self._snapshot))
+        return self.load(dict.fromkeys(warehouses))
+
+    # --- 検索 ---
+    def search(self, keywords, mode="AND", fuzzy=False):
+        return self.items_by_ids(*self.search_ids(keywords, mode, fuzzy))
+
+    def fuzzy_search(self, keywords, mode="AND"):
+        # 一致度の高い順。結果には「一致度」列が付く
+        return self.search(keywords, mode, fuzzy=True)
+
+    def search_ids(self, keywords, mode="AND", fuzzy=False, top_k=30, budget_ms=50):
+        # (品物ID のタプル, 一致度のタプル or None) を返す。同じ検索はデータの版が同じ間キャッシュから返す
+        # 時間予算で途中のキーワードまでしか見られなかったあいまい検索の結果は、絞り込みが甘いのでキャッシュしない
+        keywords = normalize_keywords(keywords, fuzzy)
+        snap = self.snapshot()
+        key = (keywords, mode, fuzzy, top_k, budget_ms, snap.items_version)
+        cached = self.search_cache.get(key)
+        if cached is not None:
+            return cached
+
+        if fuzzy:
+            _, index = self._derived(
+                'fuzzy_index', lambda s: FuzzyIndex(s.items['読み仮名'], s.items['詳細'].fillna('')), items_only=True)
+            variants = [(get_yomi(k), k) for k in keywords]
+            positions, scores, complete = index.search(variants, mode, top_k=top_k, budget_ms=budget_ms)
+            result = (tuple(snap.items['品物ID'].iloc[positions]), tuple(scores.round(3).tolist()))
+        else:
+            result = (tuple(search_items(snap.items, keywords, mode)['品物ID']), None)
+            complete = True
+        if complete:
+            self.search_cache.put(key, result)
+        return result
+
+    def items_by_ids(self, ids, scores=None):
+        # 品物ID の並び順のまま行を取り出す（見つからない ID は飛ばす）
+        snap, index = self._derived('id_index', lambda s: pd.Index(s.items['品物ID']), items_only=True)
+        positions = index.get_indexer([str(i) for i in ids])
+        found = positions >= 0
+        items = snap.items.iloc[positions[found]]
+        if scores is not None:
+            items = items.assign(一致度=[score for score, ok in zip(scores, found) if ok])
+        return items
+
+    # --- 品物名ごとのまとまり ---
+    @staticmethod
+    def _group_index(snap):
+        # データの版ごとに 1 度だけ作り、一覧・検索結果・詳細ページで共有する
+        items = snap.items
+        members = items.groupby('品物名', sort=False)['品物ID'].agg(tuple)
+        yomi = items.groupby('品物名', sort=False)['読み仮名'].first()
+        names = yomi.sort_values(kind='stable').index.tolist()
+        name_of = pd.Series(items['品物名'].to_numpy(), index=items['品物ID'].to_numpy())
+        return GroupIndex(names=names, members=members.to_dict(), name_of=name_of[~name_of.index.duplicated()],
+                          position={name: i for i, name in enumerate(names)})
+
+    def item_groups(self):
+        # [(品物名, (品物ID, ...)), ...] を読み仮名順に
+        _, groups = self._derived('groups', self._group_index, items_only=True)
+        return [(name, groups.members[name]) for name in groups.names]
+
+    def group_members(self, item_id):
+        # item_id と同じ品物名の (品物名, (品物ID, ...))。見つからなければ (None, ())
+        _, groups = self._derived('groups', self._group_index, items_only=True)
+        name = groups.name_of.get(str(item_id))
+        return (name, groups.members[name]) if name is not None else (None, ())
+
+    def group_matches(self, ids, ranked=False):
+        # 検索で一致した品物ID を品物名ごとにまとめる。ranked なら一致度順（最初に出た順）、そうでなければ読み仮名順
+        _, groups = self._derived('groups', self._group_index, items_only=True)
+        matched = {}
+        for item_id in ids:
+            name = groups.name_of.get(str(item_id))
+            if name is not None:
+                matched.setdefault(name, []).append(str(item_id))
+        names = list(matched) if ranked else sorted(matched, key=groups.position.get)
+        return [(name, matched[name]) for name in names]
+
+    def _derived(self, name, build, items_only=False):
+        # 索引などスナップショットから作るものは、データの版ごとに 1 度だけ作る。
+        # items_only: 品物の表だけから作るもの（持ち出し・返却では作り直さない）
+        snap = self.snapshot()
+        current = snap.items_version if items_only else snap.version
+        version, value = self._derived_cache.get(name, (None, None))
+        if version != current:
+            value = build(snap)
+            self._derived_cache[name] = (current, value)
+        return snap, value
+
+    # --- 分析 ---
+    def analytics(self, today=None):
+        # データの版・日付が同じ間は同じ結果を返す。履歴の集計は追記された行だけを足す
+        today = pd.Timestamp(today or date.today()).normalize()
+        snap = self.snapshot()
+        key, report = self._analytics
+        if key == (snap.version, today):
+            return report
+        with self._analytics_lock:
+            self._checkout_stats.update(snap.checkout)
+            _, active = self._derived('active_checkout', _active_checkout)
+            report = self._checkout_stats.report(snap.items, active, today)
+            self._analytics = ((snap.version, today), report)
+            return report
+
+    # --- メモリ使用量 ---
+    def shared_memory(self):
+        # 全セッションで 1 つだけ持っているスナップショットの表ごとのバイト数
+        snap = self.snapshot()
+        return {name: deep_size(getattr(snap, name)) for name in ('items', 'checkout', 'lists', 'favorites')}
+
+    def note_session_memory(self, session_id, nbytes, keep_seconds=3600):
+        # 各セッションが再実行のたびに自分の使用量を報告する。しばらく再実行のないセッションは外す
+        now = time.monotonic()
+        with self._lock:
+            self._session_memory[session_id] = (nbytes, now)
+            for sid in [sid for sid, (_, seen) in self._session_memory.items() if now - seen > keep_seconds]:
+                del self._session_memory[sid]
+
+    def session_memory(self):
+        with self._lock:
+            rows = [{'セッション': sid[:8], 'バイト数': nbytes} for sid, (nbytes, _) in self._session_memory.items()]
+        return pd.DataFrame(rows, columns=['セッション', 'バイト数']).sort_values('バイト数', ascending=False)
+
+    # --- 在庫の履歴 ---
+    def stock_history(self):
+        # 履歴用のシートは必要になったときに初めて読む。他のプロセスも追記するので、
+        # ttl 秒ごとに倉庫ごとの行数を確かめ、増えていた倉庫だけを読み直す
+        with self._history_lock:
+            now = time.monotonic()
+            if self._history is None:
+                parts = [self._read_history(name) for name in self.backends]
+                self._history = StockHistory(pd.concat([p[0] for p in parts], ignore_index=True),
+                                             pd.concat([p[1] for p in parts], ignore_index=True))
+                self._history_synced_at = now
+            elif now - self._history_synced_at > self.ttl:
+                self._sync_history(self.backends)
+                self._history_synced_at = now
+            return self._history
+
+    def _read_history(self, name):
+        backend = self.backends[name]
+        backend.ensure_worksheet(EVENT_SHEET, EVENT_COLUMNS)
+        backend.ensure_worksheet(SNAPSHOT_SHEET, SNAPSHOT_COLUMNS)
+        events = self._tag(name, _frame(backend.read_records(EVENT_SHEET), EVENT_COLUMNS))
+        snapshots = self._tag(name, _frame(backend.read_records(SNAPSHOT_SHEET), SNAPSHOT_COLUMNS))
+        self._history_rows[name] = (len(events), len(snapshots))
+        return events, snapshots
+
+    def _sync_history(self, names):
+        # 日時の列だけを読んで行数を比べ、知っている行数と違う倉庫だけを読み直して入れ替える
+        for name in names:
+            backend = self.backends[name]
+            rows = tuple(max(_filled_length(backend.read_column(sheet, 1)) - 1, 0)
+                         for sheet in (EVENT_SHEET, SNAPSHOT_SHEET))
+            if rows != self._history_rows.get(name):
+                self._history.replace_warehouse(name, *self._read_history(name))
+
+    def stock_at(self, when, item_ids=None):
+        # when 時点の 元の在庫数・持ち出し中（予約を含む）・残り。記録開始より前の品物は含まれない
+        return self.stock_history().state_at(when, item_ids)
+
+    def _stamp(self):
+        # 書き込みごとの日時。同じ倉庫の書き込みは倉庫ごとのロックで順番に来るので、前の日時より必ず後にする
+        stamp = max(pd.Timestamp.now(), self._last_stamp + pd.Timedelta(microseconds=2))
+        self._last_stamp = stamp
+        return stamp
+
+    def _record_events(self, events, before_items):
+        # 対象の倉庫の書き込みロックを持ったまま呼ぶ（反映とイベントの順番を倉庫ごとに揃えるため）。
+        # 倉庫ごとにイベントを 1 回の追記で残す。スナップショットのない品物のイベントの前には書き込み前の在庫で起点を残し
+        # （倉庫の最初のイベントなら倉庫の全品物）、品物ごとの最新のスナップショットから snapshot_every 件たまったら、
+        # 履歴そのもの（スナップショット＋イベント）から新しいスナップショットを作って残す
+        # （今の在庫表には他の書き込みが先に入っていることがあるため使わない）。
+        # 他のプロセスの追記の取り込みはスナップショットを残す前だけ行い、イベントだけなら追記 1 回で済ませる
+        if events.empty:
+            return
+        with self._history_lock:
+            if self._history is None:
+                self.stock_history()
+            history = self._history
+            stamp = self._stamp()
+            baseline_stamp = stamp.strftime(TIME_FORMAT)
+            event_stamp = (stamp + pd.Timedelta(microseconds=1)).strftime(TIME_FORMAT)
+            events = events.assign(日時=event_stamp)
+            for wh, group in events.groupby('倉庫', sort=False):
+                item_ids = set(group['品物ID'].astype(str))
+                if (not item_ids <= history.snapshot_ids(wh)
+                        or history.events_since_snapshot(wh) + len(group) >= self.snapshot_every):
+                    self._sync_history([wh])
+                known = history.snapshot_ids(wh)
+                if not item_ids <= known:
+                    rows = before_items[before_items['倉庫'] == wh]
+                    if known:
+                        rows = rows[rows['品物ID'].astype(str).isin(item_ids - known)]
+                    self._write_stock_snapshot(wh, pd.DataFrame({
+                        '品物ID': rows['品物ID'], '元の在庫数': rows['元の在庫数'],
+                        '持ち出し中の在庫数': rows['持ち出し中の在庫数'] + rows['予約中の在庫数'],
+                    }), baseline_stamp)
+                sheet_rows = group.assign(品物ID=group['品物ID'].map(self._sheet_id),
+                                          ログID=group['ログID'].map(lambda i: self._sheet_id(i) if i != '' else ''))
+                self.backends[wh].append_rows(EVENT_SHEET, sheet_rows[EVENT_COLUMNS].values.tolist())
+                history.append_events(group)
+                self._count_history_rows(wh, events=len(group))
+                if history.events_since_snapshot(wh) >= self.snapshot_every:
+                    ids = history.snapshot_ids(wh) | set(history.events.loc[history.events['倉庫'] == wh, '品物ID'])
+                    try:
+                        self._write_stock_snapshot(wh, history.state_at(event_stamp, ids), event_stamp)
+                    except Exception:
+                        # イベントは残せているので失敗にしない（件数はたまったままなので、次のイベントのときにもう一度残す）
+                        pass
+
+    def _event_steps(self, events, before_items):
+        # 履歴の記録を倉庫ごとの処理に分ける（やり直しで、記録済みの倉庫のイベントを二重に残さないように）
+        return [('events', lambda wh=wh: self._record_events(events[events['倉庫'] == wh], before_items))
+                for wh in events['倉庫'].unique()]
+
+    def _write_stock_snapshot(self, warehouse, state, stamp):
+        # state: 品物ID・元の在庫数・持ち出し中の在庫数（予約を含む）
+        snapshot = pd.DataFrame({
+            '日時': stamp, '品物ID': state['品物ID'], '元の在庫数': state['元の在庫数'],
+            '持ち出し中の在庫数': state['持ち出し中の在庫数'], '倉庫': warehouse,
+        })
+        sheet_rows = snapshot.assign(品物ID=snapshot['品物ID'].map(self._sheet_id))
+        self.backends[warehouse].append_rows(SNAPSHOT_SHEET, sheet_rows[SNAPSHOT_COLUMNS].values.tolist())
+        self._history.append_snapshot(snapshot)
+        self._count_history_rows(warehouse, snapshots=len(snapshot))
+
+    def _count_history_rows(self, warehouse, events=0, snapshots=0):
+        known_events, known_snapshots = self._history_rows.get(warehouse, (0, 0))
+        self._history_rows[warehouse] = (known_events + events, known_snapshots + snapshots)
+
+    # --- まとめて入力（ID の貼り付け・スキャン） ---
+    def _entry_index(self, snap):
+        # 入力された ID → 品物ID
+        return self._id_lookup(snap.items['品物ID'])
+
+    def _id_lookup(self, ids):
+        # 入力された ID → 表の ID。複数倉庫のときは「倉庫:ID」に加え、どの倉庫でも重ならない ID はそのままでも引ける
+        ids = ids.astype(str).drop_duplicates()
+        lookup = pd.Series(ids.to_numpy(), index=ids.to_numpy())
+        ambiguous = pd.Index([])
+        if self.multi:
+            raw = ids.str.split(':', n=1).str[-1]
+            counts = raw.map(raw.value_counts())
+            lookup = pd.concat([lookup, pd.Series(ids[counts == 1].to_numpy(), index=raw[counts == 1].to_numpy())])
+            ambiguous = pd.Index(raw[counts > 1].unique())
+        return lookup, ambiguous
+
+    def resolve_log_ids(self, log_ids):
+        # 貼り付けられたログID を持ち出しの表のログID にする。戻り値は (解決できたログID, 複数の倉庫にあるログID)
+        # 解決できない ID はそのまま返す（select_returns で一致しないので、呼び出し側で「持ち出し中ではない」とわかる）
+        _, (lookup, ambiguous) = self._derived('log_lookup', lambda s: self._id_lookup(s.checkout['ログID']))
+        log_ids = [str(i).strip() for i in log_ids]
+        unclear = [i for i in log_ids if i in ambiguous]
+        return [lookup.get(i, i) for i in log_ids if i not in ambiguous], unclear
+
+    def resolve_bulk_entry(self, text, cart=None):
+        # 貼り付け・スキャンした一覧を 1 回の照合で品物ID に解決し、不明な ID と在庫を超える行をまとめて返す
+        cart = cart or {}
+        lines = parse_bulk_entry(text)
+        snap, (lookup, ambiguous) = self._derived('entry_index', self._entry_index)
+        readable = lines['問題'] == ''
+        resolved = lines['品物ID'].map(lookup)
+        lines.loc[readable & lines['品物ID'].isin(ambiguous), '問題'] = "複数の倉庫にある ID です（倉庫:ID で指定してください）"
+        lines.loc[(lines['問題'] == '') & resolved.isna(), '問題'] = "品物ID が見つかりません"
+
+        ok = lines['問題'] == ''
+        totals = lines[ok].groupby(resolved[ok])['数量'].sum()
+        remaining = snap.items.drop_duplicates('品物ID').set_index('品物ID')['残りの在庫数']
+        in_cart = pd.Series({str(k): int(v) for k, v in cart.items()}, dtype='int64')
+        wanted = totals + in_cart.reindex(totals.index, fill_value=0)
+        over = wanted[wanted > remaining.reindex(totals.index, fill_value=0)]
+        for item_id in over.index:
+            left, already = int(remaining.get(item_id, 0)), int(in_cart.get(item_id, 0))
+            lines.loc[ok & (resolved == item_id), '問題'] = (
+                f"在庫が足りません（残り {left} / カート {already} + 入力 {int(totals[item_id])}）")
+
+        problems = lines[lines['問題'] != ''].reset_index(drop=True)
+        additions = {item_id: int(qty) for item_id, qty in totals.drop(over.index).items()}
+        return BulkEntryResult(additions=additions, problems=problems)
+
+    # --- 予約・日付範囲の空き ---
+    def free_between(self, item_ids, start, end):
+        # 品物ID → start〜end の間ずっと空いている数（元の在庫数 − 期間中の最大使用数）
+        snap, index = self._derived('availability', lambda s: AvailabilityIndex(
+            build_intervals(s.checkout[is_active(s.checkout)], date.today())))
+        stock = snap.items.drop_duplicates('品物ID').set_index('品物ID')['元の在庫数']
+        return pd.Series({
+            str(i): int(stock.get(str(i), 0)) - index.peak(i, start, end) for i in item_ids
+        }, dtype='int64')
+
+    def check_availability(self, cart, start, end):
+        # カートの数量が start〜end の間に確保できるかを確認し、足りない行を返す
+        if pd.Timestamp(end) < pd.Timestamp(start):
+            raise ValueError("持ち出し終了日は持ち出し開始日以降にしてください。")
+        free = self.free_between(list(cart), start, end)
+        return [
+            {'品物ID': str(item_id), '要求数': int(qty), '残り': max(0, int(free[str(item_id)]))}
+            for item_id, qty in cart.items() if int(qty) > free[str(item_id)]
+        ]
+
+    # --- 持ち出し ---
+    def checkout(self, cart, destination, borrower, start_date, end_date, on_shortage="reject", idempotency_key=None):
+        return self.checkout_many([{
+            'cart': cart, 'destination': destination, 'borrower': borrower,
+            'start_date': start_date, 'end_date': end_date,
+        }], on_shortage=on_shortage, idempotency_key=idempotency_key)
+
+    def checkout_many(self, orders, on_shortage="reject", retries=3, idempotency_key=None):
+        # idempotency_key を渡すと、同じキーでの 2 回目以降は書き込まずに最初の結果（repeated=True）を返す
+        result, repeated = self.submissions.run(
+            idempotency_key, lambda on_written: self._checkout_many(orders, on_shortage, retries, on_written))
+        return replace(result, repeated=True) if repeated else result
+
+    def _checkout_many(self, orders, on_shortage, retries, on_written=None):
+        # 複数カートをまとめて 1 回の追記で登録する。
+        # 確定直前に対象品物の持ち出し中数だけを読み直して書き込み、追記した後にもう一度読んで他の人の追記と重なっていないか確かめる。
+        # on_shortage="reject" は不足があれば StockConflictError、"trim" は残り数まで減らして登録する。
+        lines = pd.DataFrame(
+            [(str(item_id), int(qty), o['destination'], o['borrower'],
+              _date_str(o['start_date']), _date_str(o['end_date']))
+             for o in orders for item_id, qty in o['cart'].items() if int(qty) > 0],
+            columns=['品物ID', '持ち出し数', '持ち出し先', '持ち出し者', '持ち出し開始日', '持ち出し終了日']
+        )
+        if lines.empty:
+            return CheckoutResult(log_ids=[])
+        if (lines['持ち出し終了日'] < lines['持ち出し開始日']).any():
+            raise ValueError("持ち出し終了日は持ち出し開始日以降にしてください。")
+
+        items = self.snapshot().items.drop_duplicates('品物ID').set_index('品物ID')
+        lines['品物名'] = lines['品物ID'].map(items['品物名'])
+        unknown = lines.loc[lines['品物名'].isna(), '品物ID'].unique().tolist()
+        if unknown:
+            raise ValueError(f"在庫リストに存在しない品物IDです: {', '.join(unknown)}")
+
+        lines['倉庫'] = lines['品物ID'].map(items['倉庫'])
+        warehouses = lines['倉庫'].unique()
+
+        # 在庫の確認は品物ごとのロック、ログID・行番号の採番から追記・反映までは倉庫ごとのロックの中で行う
+        # （別の品物の持ち出しでも同じ倉庫なら採番が重ならないように）
+        with self._locked_items(lines['品物ID'].unique()), self._locked_warehouses(warehouses):
+            base, loads = self._write_base()
+            for _ in range(retries):
+                # 倉庫ごとに対象品物の持ち出し中の行を読み直し、最新の持ち出し中の行から割り当てられる数を求める
+                reads = {wh: self._read_active(wh, lines.loc[lines['倉庫'] == wh, '品物ID'].unique())
+                         for wh in warehouses}
+                active = pd.concat([r[2] for r in reads.values()], ignore_index=True)
+                allowed = _allowed(lines, items, active)
+                short = lines[allowed < lines['持ち出し数']]
+                shortages = [
+                    {'品物ID': row['品物ID'], '要求数': int(row['持ち出し数']), '残り': int(allowed[i])}
+                    for i, row in short.iterrows()
+                ]
+                if shortages and on_shortage == "reject":
+                    raise StockConflictError(shortages)
+
+                rows = lines.assign(持ち出し数=allowed.astype(int))
+                rows = rows[rows['持ち出し数'] > 0].copy()
+                rows[RETURNED_COL] = "FALSE"
+                if rows.empty:
+                    return CheckoutResult(log_ids=[], shortages=shortages)
+                # ログID は倉庫ごとにそのシートの続きとして振り、行番号は追記した結果の位置を使う
+                per_wh = []
+                for wh, group in rows.groupby('倉庫', sort=False):
+                    version, next_id, _, _ = reads[wh]
+                    group = group.assign(ログID=range(next_id, next_id + len(group)))
+                    sheet_rows = group.assign(品物ID=group['品物ID'].map(self._raw_id))[CHECKOUT_COLUMNS[:-1]]
+                    first = self.backends[wh].append_rows(CHECKOUT_SHEET, sheet_rows.values.tolist()) or version + 1
+                    per_wh.append(group.assign(行番号=range(first, first + len(group))))
+
+                # 他のプロセスが同じ時に追記していたら、シート上で先にある行を優先する。
+                # 自分の行のどれかが負けていたら（ログID が先の行と重なった・在庫が足りない）、自分の行をすべて取り消してやり直す
+                try:
+                    won = all(self._checkout_won(group, items) for group in per_wh)
+                except Exception:
+                    # 確かめられないまま行を残すと、やり直しで二重に登録される
+                    self._void_checkouts(per_wh)
+                    raise
+                if not won:
+                    self._void_checkouts(per_wh)
+                    continue
+
+                written = pd.concat(per_wh)
+                if self.multi:
+                    written['ログID'] = written['倉庫'] + ':' + written['ログID'].astype(str)
+                written = written[CHECKOUT_COLUMNS[:-1] + ['倉庫', '行番号']]
+                touched = list(written['倉庫'].unique())
+                result = CheckoutResult(log_ids=written['ログID'].tolist(), shortages=shortages)
+                self._finish_write(on_written, result, touched, [
+                    ('touch', lambda: self._touch(touched)),
+                    ('publish', lambda: self._publish_write(touched, loads, lambda current: dict(
+                        checkout=pd.concat([current.checkout, written], ignore_index=True),
+                        changed_items=written['品物ID']))),
+                ] + self._event_steps(pd.DataFrame({
+                    '倉庫': written['倉庫'], '種別': '持ち出し', '品物ID': written['品物ID'], '在庫増減': 0,
+                    '持ち出し増減': written['持ち出し数'], 'ログID': written['ログID'], '備考': written['持ち出し先'],
+                }), base.items))
+                return result
+
+        raise StockConflictError([])
+
+    def _finish_write(self, on_written, result, warehouses, steps):
+        # 主の書き込みが終わったところで送信キーを覚えてから、残りの処理 steps（[(名前, 関数)]）を順に行う。
+        # 途中で失敗したら、同じ送信キーのやり直しで終わっていない処理だけを続ける
+        if on_written is not None:
+            on_written(result, lambda: self._resume_write(warehouses, steps))
+        _run_steps(steps)
+
+    def _resume_write(self, warehouses, steps):
+        # 時間がたっているので、メモリ上の反映は書き込みを重ねずに、書き込んだ倉庫の読み直しにする
+        with self._locked_warehouses(warehouses):
+            steps[:] = [(name, (lambda: self.load(dict.fromkeys(warehouses))) if name == 'publish' else step)
+                        for name, step in steps]
+            _run_steps(steps)
+
+    def _locked_items(self, item_ids):
+        # 品物ごとのロックだけを取るので、別の品物の持ち出しは並行して進む
+        stack = ExitStack()
+        with self._item_locks_guard:
+            locks = [self._item_locks[item_id] for item_id in sorted(item_ids)]
+        for lock in locks:
+            stack.enter_context(lock)
+        return stack
+
+    def _locked_warehouses(self, warehouses):
+        # 倉庫名の順に取り、複数の倉庫にまたがる書き込み同士でもデッドロックしないようにする。
+        # 共有キャッシュがあれば、同じ倉庫に書き込む他のプロセスとも借用で順番にする
+        stack = ExitStack()
+        for name in sorted(set(warehouses)):
+            stack.enter_context(self._write_locks[name])
+            if self.shared_cache is not None:
+                stack.enter_context(self.shared_cache.lease(f"write|{name}"))
+        return stack
+
+    def _read_active(self, warehouse, item_ids):
+        # CheckoutLog 全体ではなく ログID・品物ID・持ち出し数・期間・返却済み の列だけを読む。
+        # (ログID 列の埋まっている行数, 次のログID, 対象品物の持ち出し中の行, 全行) を返す
+        names = ['ログID', '品物ID', '持ち出し数', '持ち出し開始日', '持ち出し終了日', RETURNED_COL]
+        columns = self.backends[warehouse].read_columns(
+            CHECKOUT_SHEET, [self._col(warehouse, CHECKOUT_SHEET, c) for c in names])
+        log = pd.DataFrame({name: values[1:] for name, values in zip(names, columns)})
+        log['品物ID'] = self._qualify(warehouse, log['品物ID']) if self.multi else log['品物ID'].astype(str)
+        log['行番号'] = log.index + 2
+        active = log[is_active(log) & log['品物ID'].isin(item_ids)]
+        numeric_ids = pd.to_numeric(log['ログID'], errors='coerce')
+        next_id = int(numeric_ids.max()) + 1 if numeric_ids.notna().any() else 1
+        return _filled_length(columns[0]), next_id, active, log
+
+    def _checkout_won(self, group, items):
+        # 追記した行を読み直し、同じログID の先の行がなく、自分より前の行だけで在庫が足りていれば True。
+        # 同時に追記した全員が同じシートの並びで判定するので、先の行は残り、後の行は取り消される
+        wh = group['倉庫'].iloc[0]
+        _, _, active, log = self._read_active(wh, group['品物ID'].unique())
+        first_row = pd.Series(log['行番号'].to_numpy(), index=log['ログID'].astype(str))
+        first_row = first_row[~first_row.index.duplicated()]
+        if (first_row.reindex(group['ログID'].astype(str)).to_numpy() != group['行番号'].to_numpy()).any():
+            return False
+        earlier = active[active['行番号'] < group['行番号'].min()]
+        return bool((_allowed(group, items, earlier) >= group['持ち出し数']).all())
+
+    def _void_checkouts(self, per_wh):
+        # 取り消す行は消さずに、持ち出し数 0・返却済みにする（行の位置を変えないため）。ログID は先の行が優先される
+        for group in per_wh:
+            wh = group['倉庫'].iloc[0]
+            columns = [self._col(wh, CHECKOUT_SHEET, c) for c in ('持ち出し数', RETURNED_COL, '返却数量')]
+            cells = [(int(row), col, value) for row in group['行番号'] for col, value in zip(columns, (0, 'TRUE', 0))]
+            self.backends[wh].batch_update({CHECKOUT_SHEET: cells})
+        self._touch(group['倉庫'].iloc[0] for group in per_wh)
+
+    # --- 持ち出し中の一覧 ---
+    @staticmethod
+    def _checkout_groups(snap):
+        # (持ち出し先, 持ち出し者) ごとの 開始日・終了日・件数 をデータの版ごとに 1 度だけ集計する
+        active = _active_checkout(snap)
+        groups = active.groupby(['持ち出し先', '持ち出し者'], sort=False).agg(
+            開始日=('開始日', 'min'), 終了日=('終了日', 'max'), 最も早い終了日=('終了日', 'min'),
+            件数=('ログID', 'size'), 持ち出し数=('持ち出し数', 'sum'))
+        return groups.reset_index()
+
+    def checkout_groups(self, sites=None, people=None, overdue_only=False, start=None, end=None,
+                        sort='終了日', ascending=True, today=None):
+        # 持ち出し中の (持ち出し先, 持ち出し者) を条件で絞り込んで並べ替える（未指定の条件は無視）
+        # 延滞 = 終了日を過ぎた行が 1 つでもある。start/end は持ち出し開始日（いちばん早いもの）の範囲
+        _, groups = self._derived('checkout_groups', self._checkout_groups)
+        today = pd.Timestamp(today or date.today()).normalize()
+        groups = groups.assign(延滞=groups['最も早い終了日'] < today)
+        mask = pd.Series(True, index=groups.index)
+        if sites:
+            mask &= groups['持ち出し先'].isin(sites)
+        if people:
+            mask &= groups['持ち出し者'].isin(people)
+        if overdue_only:
+            mask &= groups['延滞']
+        if start is not None:
+            mask &= groups['開始日'] >= pd.Timestamp(start)
+        if end is not None:
+            mask &= groups['開始日'] <= pd.Timestamp(end)
+        return groups[mask].sort_values([sort, '持ち出し先', '持ち出し者'], ascending=[ascending, True, True],
+                                         kind='stable', na_position='last').reset_index(drop=True)
+
+    # --- 返却 ---
+    def select_returns(self, sites=None, people=None, start=None, end=None, log_ids=None):
+        # 持ち出し中の行を 現場・持ち出し者・持ち出し開始日の範囲・ログID で絞り込む（未指定の条件は無視）
+        _, active = self._derived('active_checkout', _active_checkout)
+        mask = pd.Series(True, index=active.index)
+        if sites:
+            mask &= active['持ち出し先'].isin(sites)
+        if people:
+            mask &= active['持ち出し者'].isin(people)
+        if start is not None:
+            mask &= active['開始日'] >= pd.Timestamp(start)
+        if end is not None:
+            mask &= active['開始日'] <= pd.Timestamp(end)
+        if log_ids is not None:
+            mask &= active['ログID'].astype(str).isin([str(i).strip() for i in log_ids])
+        return active[mask]
+
+    def return_matching(self, **filters):
+        # 条件に合う持ち出し中の行を、全数返却・破損なしでまとめて返却する
+        target = self.select_returns(**filters)
+        return self.return_items({
+            row['ログID']: {"返却数量": int(row['持ち出し数']), "破損数量": 0}
+            for _, row in target.iterrows()
+        })
+
+    def return_items(self, return_items, idempotency_key=None):
+        # return_items: {ログID: {"返却数量": n, "破損数量": m}}
+        # 全行を持ち出し中データと照合し、1 行でも不正なら何も書き込まずに ReturnValidationError
+        # idempotency_key を渡すと、同じキーでの 2 回目以降は何も書き込まない（スナップショットは覚えずに今のものを返す）
+        self.submissions.run(idempotency_key, lambda on_written: self._return_items(return_items, on_written).version)
+        return self.snapshot()
+
+    def _return_items(self, return_items, on_written=None):
+        if not return_items:
+            return self.snapshot()
+        requests = pd.DataFrame([
+            {'ログID': str(log_id), '返却数量': int(data["返却数量"]), '破損数量': int(data.get("破損数量", 0))}
+            for log_id, data in return_items.items()
+        ])
+
+        # 返却・破損の反映とイベントの記録は、対象の倉庫の書き込みロックを持ったまま続けて行う
+        # （ログID は複数倉庫なら「倉庫:ID」、1 つならその倉庫。存在しないログID は下の照合で弾かれる）
+        warehouses = [i.split(':', 1)[0] for i in requests['ログID']] if self.multi else list(self.backends)
+        with self._locked_warehouses(w for w in warehouses if w in self.backends):
+            # 照合・シートの確認・書き込みは倉庫の書き込みロックの中で行い、self._lock は最初と反映のときだけ持つ
+            with self._lock:
+                snap, row_of = self._derived('log_rows', _log_rows)
+                loads = self._loads
+            checkout = snap.checkout.copy()
+            items = snap.items
+
+            requests['idx'] = requests['ログID'].map(row_of)
+            known = requests['idx'].notna()
+            requests['持ち出し数'] = requests['idx'].map(checkout['持ち出し数']).fillna(0).astype(int)
+            requests['active'] = requests['idx'].map(is_active(checkout)).fillna(False).astype(bool)
+            requests['品物ID'] = requests['idx'].map(checkout['品物ID'])
+
+            active = known & requests['active']
+            bad_qty = (requests['返却数量'] < 0) | (requests['返却数量'] > requests['持ち出し数'])
+            bad_damage = (requests['破損数量'] < 0) | (requests['破損数量'] > requests['持ち出し数'] - requests['返却数量'])
+            problems = (
+                [f"ログID {i} は存在しません" for i in requests.loc[~known, 'ログID']]
+                + [f"ログID {i} は返却済みです" for i in requests.loc[known & ~requests['active'], 'ログID']]
+                + [f"ログID {i} の返却数量が不正です" for i in requests.loc[active & bad_qty, 'ログID']]
+                + [f"ログID {i} の破損数量が不正です" for i in requests.loc[active & ~bad_qty & bad_damage, 'ログID']]
+            )
+            if problems:
+                raise ReturnValidationError(problems)
+
+            # --- CheckoutLog の返却済み・返却数量 ---
+            idx = requests['idx'].astype(int).to_numpy()
+            checkout = self._verify_rows(checkout, idx)
+            checkout.loc[idx, RETURNED_COL] = 'TRUE'
+            # 返却数量が空欄だけの列は文字列型で読まれるので、数値を入れる前に object 型にしておく
+            checkout['返却数量'] = checkout['返却数量'].astype(object)
+            checkout.loc[idx, '返却数量'] = requests['返却数量'].to_numpy()
+            updates = defaultdict(lambda: defaultdict(list))
+            columns = {wh: (self._col(wh, CHECKOUT_SHEET, RETURNED_COL), self._col(wh, CHECKOUT_SHEET, '返却数量'))
+                       for wh in checkout.loc[idx, '倉庫'].unique()}
+            for wh, row, qty in zip(checkout.loc[idx, '倉庫'], checkout.loc[idx, '行番号'], requests['返却数量']):
+                returned_col, qty_col = columns[wh]
+                updates[wh][CHECKOUT_SHEET] += [(int(row), returned_col, 'TRUE'), (int(row), qty_col, int(qty))]
+
+            # --- 破損・滅失は品物ごとに合計し、在庫調整として追記する（在庫数は 0 未満にしない）---
+            damaged_rows = requests[requests['破損数量'] > 0]
+            damaged = damaged_rows.groupby('品物ID')['破損数量'].sum()
+            item_rows = items[items['品物ID'].isin(damaged.index)].drop_duplicates('品物ID')
+            new_stock = (item_rows['元の在庫数'] - item_rows['品物ID'].map(damaged)).clip(lower=0)
+            log_ids = damaged_rows.groupby('品物ID')['ログID'].agg(lambda ids: ','.join(self._raw_id(i) for i in ids))
+            adjustments = pd.DataFrame({
+                '倉庫': item_rows['倉庫'], '品物ID': item_rows['品物ID'], '増減': new_stock - item_rows['元の在庫数'],
+                '種別': '破損・滅失', 'ログID': item_rows['品物ID'].map(log_ids),
+                '備考': [f"破損・滅失 {d}" for d in item_rows['品物ID'].map(damaged)],
+            })
+            events = pd.concat([
+                pd.DataFrame({
+                    '倉庫': checkout.loc[idx, '倉庫'].to_numpy(), '種別': '返却', '品物ID': requests['品物ID'].to_numpy(),
+                    '在庫増減': 0, '持ち出し増減': -requests['持ち出し数'].to_numpy(), 'ログID': requests['ログID'].to_numpy(),
+                    '備考': [f"返却数量 {q}" for q in requests['返却数量']],
+                }),
+                pd.DataFrame({
+                    '倉庫': item_rows['倉庫'], '種別': '破損', '品物ID': item_rows['品物ID'],
+                    '在庫増減': new_stock - item_rows['元の在庫数'], '持ち出し増減': 0, 'ログID': '',
+                    '備考': [f"破損・滅失 {d}" for d in item_rows['品物ID'].map(damaged)],
+                }),
+            ], ignore_index=True)
+
+            # 倉庫（スプレッドシート）ごとに 1 回の API 呼び出しでまとめて書き込む
+            for wh, cells in updates.items():
+                self.backends[wh].batch_update(dict(cells))
+            touched = list(updates)
+            added = []
+
+            # 書き込んだ倉庫の行の 返却済み・返却数量・行番号 を、今のスナップショットの同じ行に重ねる
+            # （読み込みがなければ、他の倉庫への書き込みがあっても既存の行の位置は変わらない）
+            changed = checkout.loc[checkout['倉庫'].isin(list(updates)), [RETURNED_COL, '返却数量', '行番号']]
+
+            def on_current(current):
+                merged = current.checkout.copy()
+                merged['返却数量'] = merged['返却数量'].astype(object)
+                if merged['行番号'].dtype != changed['行番号'].dtype:
+                    merged['行番号'] = merged['行番号'].astype('Int64')
+                merged.loc[changed.index, changed.columns] = changed
+                frames = dict(checkout=merged, changed_items=requests['品物ID'])
+                if not added[0].empty:
+                    frames['adjustments'] = pd.concat([current.adjustments, added[0]], ignore_index=True)
+                return frames
+
+            self._finish_write(on_written, None, touched, [
+                ('adjustments', lambda: added.append(self._append_adjustments(adjustments))),
+                ('touch', lambda: self._touch(touched)),
+                ('publish', lambda: self._publish_write(touched, loads, on_current)),
+            ] + self._event_steps(events, snap.items))
+        return self.snapshot()
+
+    def _verify_rows(self, checkout, idx):
+        # 書き込む行の 行番号 が今もシート上で同じログID の行かを、倉庫ごとにログID の列 1 回の読み取りで確かめる。
+        # 他の人の追記・削除・並べ替えでずれていたら、読んだ列からその倉庫の 行番号 を付け直す（全体は読み直さない）
+        targets = checkout.loc[idx]
+        for wh, group in targets.groupby('倉庫', sort=False):
+            column = self.backends[wh].read_column(CHECKOUT_SHEET, self._col(wh, CHECKOUT_SHEET, 'ログID'))
+            if not column or str(column[0]) != 'ログID':
+                # 列の並びが変わっている。この倉庫だけ読み直して列番号を引き直し、今回は書き込まない
+                self.load([wh])
+                raise ReturnValidationError([f"{wh} の CheckoutLog の列の並びが変わっていたため読み直しました。もう一度返却してください。"])
+            sheet_ids = pd.Series([str(v) for v in column])
+            raw_ids = group['ログID'].map(self._raw_id)
+            # 前回の付け直しでシートから消えていた行は 行番号 が空なので、0（どの行とも一致しない）として扱う
+            rows = pd.to_numeric(group['行番号'], errors='coerce').fillna(0).astype(int).to_numpy()
+            on_sheet = sheet_ids.reindex(rows - 1).to_numpy()
+            if (on_sheet == raw_ids.to_numpy()).all():
+                continue
+            # シート上の行番号 = 列の中の位置 + 1（同じログID が複数あれば先頭の行）
+            located = pd.Series(sheet_ids.index + 1, index=sheet_ids.to_numpy())
+            located = located[~located.index.duplicated()].drop('ログID', errors='ignore')
+            in_wh = checkout['倉庫'] == wh
+            moved = checkout.loc[in_wh, 'ログID'].map(self._raw_id).map(located)
+            missing = [log_id for log_id, raw in zip(group['ログID'], raw_ids) if raw not in located.index]
+            if missing:
+                raise ReturnValidationError([f"ログID {i} がシート上に見つかりません（削除・移動された可能性があります）"
+                                             for i in missing])
+            checkout['行番号'] = checkout['行番号'].astype('Int64')
+            checkout.loc[in_wh, '行番号'] = moved.astype('Int64')
+        return checkout
+
+    def adjust_stock(self, changes, kind='入荷', note=''):
+        # changes: {品物ID: 増減}。入荷・棚卸しの差などを在庫調整として追記する（Items シートは書き換えない）
+        changes = {str(item_id): int(delta) for item_id, delta in changes.items() if int(delta) != 0}
+        if not changes:
+            return self.snapshot()
+        warehouse = self.snapshot().items.drop_duplicates('品物ID').set_index('品物ID')['倉庫']
+        unknown = [item_id for item_id in changes if item_id not in warehouse.index]
+        if unknown:
+            raise ValueError(f"品物ID が見つかりません: {', '.join(unknown)}")
+        adjustments = pd.DataFrame({
+            '倉庫': [warehouse[i] for i in changes], '品物ID': list(changes), '増減': list(changes.values()),
+            '種別': kind, 'ログID': '', '備考': note,
+        })
+        with self._locked_warehouses(adjustments['倉庫']):
+            snap, loads = self._write_base()
+            added = self._append_adjustments(adjustments)
+            self._touch(adjustments['倉庫'])
+            published = self._publish_write(adjustments['倉庫'].unique(), loads, lambda current: dict(
+                adjustments=pd.concat([current.adjustments, added], ignore_index=True), changed_items=list(changes)))
+            self._record_events(adjustments.assign(在庫増減=adjustments['増減'], 持ち出し増減=0, 種別=kind), snap.items)
+        return published
+
+    def _append_adjustments(self, adjustments):
+        # 倉庫ごとに 1 回の追記で在庫調整の行を書き、書いた行（日時つき）を返す
+        if adjustments.empty:
+            return adjustments
+        adjustments = adjustments.assign(日時=now_str())
+        for wh, group in adjustments.groupby('倉庫', sort=False):
+            rows = group.assign(品物ID=group['品物ID'].map(self._sheet_id))
+            self.backends[wh].append_rows(ADJUSTMENT_SHEET, rows[ADJUSTMENT_COLUMNS].values.tolist())
+        return adjustments
+
+    # --- 発注点 ---
+    def thresholds(self):
+        # 品物ID → 発注点（発注点のない品物は含まない）
+        _, latest = self._derived('thresholds', lambda s: latest_thresholds(s.thresholds))
+        return latest
+
+    def set_thresholds(self, thresholds):
+        # thresholds: {品物ID: 発注点 or None}。None は発注点なしに戻す。Thresholds シートに追記する
+        thresholds = {str(item_id): value for item_id, value in thresholds.items()}
+        if not thresholds:
+            return self.snapshot()
+        with self._lock:
+            snap = self.snapshot()
+            warehouse = snap.items.drop_duplicates('品物ID').set_index('品物ID')['倉庫']
+            unknown = [item_id for item_id in thresholds if item_id not in warehouse.index]
+            if unknown:
+                raise ValueError(f"品物ID が見つかりません: {', '.join(unknown)}")
+            rows = pd.DataFrame({
+                '倉庫': [warehouse[i] for i in thresholds], '品物ID': list(thresholds),
+                '発注点': ['' if v is None else int(v) for v in thresholds.values()], '日時': now_str(),
+            })
+            for wh, group in rows.groupby('倉庫', sort=False):
+                sheet_rows = group.assign(品物ID=group['品物ID'].map(self._sheet_id))
+                self.backends[wh].append_rows(THRESHOLD_SHEET, sheet_rows[THRESHOLD_COLUMNS].values.tolist())
+            self._touch(rows['倉庫'])
+            self._low_stock.set_thresholds({i: np.nan if v is None else float(v) for i, v in thresholds.items()})
+            return self._publish(thresholds=pd.concat([snap.thresholds, rows], ignore_index=True),
+                                 changed_items=list(thresholds))
+
+    def low_stock(self):
+        # 発注点以下の品物だけの表（不足数 = 発注点 − 残りの在庫数 の大きい順）
+        snap = self.snapshot()
+        items = self.items_by_ids(sorted(snap.low_stock))
+        items = items[['品物ID', '品物名', '詳細', '元の在庫数', '残りの在庫数', '倉庫']].copy()
+        items['発注点'] = items['品物ID'].map(self.thresholds())
+        # 読んでいる間に発注点が外された品物は除く
+        items = items[items['発注点'].notna()].astype({'発注点': int})
+        items['不足数'] = items['発注点'] - items['残りの在庫数']
+        return items.sort_values(['不足数', '品物ID'], ascending=[False, True], kind='stable').reset_index(drop=True)
+
+    # --- いつものカート ---
+    @staticmethod
+    def _favorite_index(snap):
+        # (持ち出し先, メモ) → ((品物ID, 数量), ...) と 持ち出し先 → [メモ, ...] をデータの版ごとに 1 度だけ作る
+        df = snap.favorites
+        qty = pd.to_numeric(df['数量'], errors='coerce').fillna(0).astype(int)
+        lines = pd.Series(list(zip(df['品物ID'].astype(str), qty)), index=df.index)
+        templates = {key: tuple(group) for key, group in lines.groupby([df['持ち出し先'], df['メモ']], sort=True)}
+        memos = {}
+        for site, memo in templates:
+            memos.setdefault(site, []).append(memo)
+        return templates, memos
+
+    def favorite_memos(self, site):
+        _, (_, memos) = self._derived('favorites', self._favorite_index)
+        return memos.get(site, [])
+
+    def favorite_templates(self, site):
+        _, (templates, memos) = self._derived('favorites', self._favorite_index)
+        return {memo: [{'品物ID': item_id, '数量': qty} for item_id, qty in templates[(site, memo)]]
+                for memo in memos.get(site, [])}
+
+    def resolve_template(self, site, memo):
+        # 定型カートの全行を 1 回の索引引きで品物に結び付け、今の残りの在庫数と不足をつける
+        _, (templates, _) = self._derived('favorites', self._favorite_index)
+        lines = pd.DataFrame(list(templates.get((site, memo), ())), columns=['品物ID', '数量'])
+        snap, index = self._derived('id_index', lambda s: pd.Index(s.items['品物ID']), items_only=True)
+        positions = index.get_indexer(lines['品物ID'])
+        found = positions >= 0
+        items = snap.items.iloc[positions[found]]
+        lines['見つかった'] = found
+        for col in ['品物名', '詳細']:
+            lines[col] = ''
+            lines.loc[found, col] = items[col].to_numpy()
+        lines['残りの在庫数'] = 0
+        lines.loc[found, '残りの在庫数'] = items['残りの在庫数'].to_numpy()
+        lines['不足'] = found & (lines['数量'] > lines['残りの在庫数'])
+        return lines
+
+    def register_favorite(self, site, memo, cart):
+        # 同じ内容がすでにあれば False を返して何も書き込まない
+        df = pd.DataFrame(
+            [{'持ち出し先': site, '品物ID': str(item_id) if self.multi else int(item_id), '数量': qty, 'メモ': memo}
+             for item_id, qty in cart.items()],
+            columns=FAVORITE_COLUMNS
+        )
+        with self._lock:
+            snap = self.snapshot()
+            favorites = snap.favorites[[c for c in snap.favorites.columns if c not in ('倉庫', '行番号')]]
+            common_cols = list(set(df.columns) & set(favorites.columns))
+            if not df.empty and common_cols:
+                df_str = df.astype({col: str for col in common_cols})
+                favorites_str = favorites.astype({col: str for col in common_cols})
+                merged = df_str.merge(favorites_str, how='inner', on=common_cols)
+                if len(merged) == len(df_str) and merged.equals(df_str):
+                    return False
+
+            # 品物のある倉庫のシートに、その倉庫の品物の行だけを追記する
+            df['倉庫'] = df['品物ID'].astype(str).map(snap.items.drop_duplicates('品物ID').set_index('品物ID')['倉庫'])
+            df['倉庫'] = df['倉庫'].fillna(next(iter(self.backends)))
+            added = []
+            for wh, group in df.groupby('倉庫', sort=False):
+                count = int((snap.favorites['倉庫'] == wh).sum())
+                sheet_rows = group.assign(品物ID=group['品物ID'].map(self._sheet_id))
+                self.backends[wh].append_rows(FAVORITE_SHEET, sheet_rows[FAVORITE_COLUMNS].values.tolist())
+                added.append(group.assign(行番号=range(count + 2, count + 2 + len(group))))
+            self._touch(df['倉庫'])
+            self._publish(favorites=pd.concat([snap.favorites] + added, ignore_index=True))
+            return True
+
+    def delete_favorite(self, site, memo):
+        # 対象の定型カートを持つ倉庫のシートだけを書き直す
+        with self._lock:
+            df = self.snapshot().favorites
+            target = (df['持ち出し先'] == site) & (df['メモ'] == memo)
+            kept = []
+            for wh, group in df.groupby('倉庫', sort=False):
+                remaining = group[~target.loc[group.index]]
+                if len(remaining) != len(group):
+                    header = self._headers[wh][FAVORITE_SHEET]
+                    sheet_rows = remaining.assign(品物ID=remaining['品物ID'].map(self._sheet_id))
+                    self.backends[wh].replace_all(FAVORITE_SHEET, header, sheet_rows[header].values.tolist())
+                    self._touch([wh])
+                    remaining = remaining.assign(行番号=range(2, 2 + len(remaining)))
+                kept.append(remaining)
+            new_df = pd.concat(kept, ignore_index=True) if kept else df.iloc[0:0]
+            return self._publish(favorites=new_df)
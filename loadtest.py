@@ -0,0 +1,191 @@
+# ✅ 同時セッションの負荷試験
+# --- AppTest で本物の画面関数を複数セッション同時に動かし（検索→カート→持ち出し確定→返却）、
+#     偽のスプレッドシート（待ち時間つき）に対する再実行の所要時間と API 呼び出し回数を同時数ごとに測る ---
+#
+# 使い方: python loadtest.py --sessions 1,2,4,8 --iterations 3 --latency 0.2 --jitter 0.05
+
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)
+
+import streamlit as st
+import streamlit.testing.v1.app_test as app_test_module
+import streamlit.testing.v1.local_script_runner as local_script_runner_module
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.util import patch_config_options
+
+import fake_backend
+
+KEYWORDS = ['ドリル', 'カッター', '脚立', 'ハンマー', 'コード', 'グラインダー']
+
+
+class _PinnedRuntimeMeta(type(Runtime)):
+    def __setattr__(cls, name, value):
+        if name != '_instance':
+            super().__setattr__(name, value)
+        elif value is not None and Runtime._instance is None:
+            Runtime._instance = value
+
+
+class _PinnedRuntime(Runtime, metaclass=_PinnedRuntimeMeta):
+    pass
+
+
+@contextmanager
+def shared_runtime():
+    # AppTest は 1 つずつ実行する前提で、実行のたびに Runtime._instance・設定値を差し替えて元に戻し、
+    # スクリプトも毎回コンパイルし直す。同時に動かすと他のセッションの実行中に戻されたり ast.parse が競合したりするので、
+    # 本物のサーバーと同じく Runtime・設定・コンパイル済みスクリプトを全セッションで共有する
+    script_cache = ScriptCache()
+    app_test_module.Runtime = _PinnedRuntime
+    app_test_module.ScriptCache = local_script_runner_module.ScriptCache = lambda: script_cache
+    app_test_module.patch_config_options = lambda overrides: nullcontext()
+    try:
+        with patch_config_options({"global.appTest": True}):
+            yield
+    finally:
+        app_test_module.Runtime = Runtime
+        app_test_module.ScriptCache = local_script_runner_module.ScriptCache = ScriptCache
+        app_test_module.patch_config_options = patch_config_options
+        Runtime._instance = None
+
+
+class SessionRecorder:
+    def __init__(self):
+        self.timings = []
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def step(self, name, at, action):
+        # 1 回の再実行（ボタン押下・ページ移動）にかかった時間を記録する
+        started = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.timings.append((name, elapsed))
+            self.errors.extend(f"{name}: {e.value}" for e in at.exception)
+
+
+def button_keys(at, prefix):
+    return [b.key for b in at.button if b.key and b.key.startswith(prefix)]
+
+
+def run_session(app_path, index, iterations, recorder, start_gate, timeout):
+    # 1 人分の操作。現場と持ち出し者はセッションごとに分け、他のセッションの持ち出しを返却しないようにする
+    site, person = f"現場{index % 20 + 1:02d}", f"作業員{index % 20 + 1:02d}"
+    keyword = KEYWORDS[index % len(KEYWORDS)]
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    start_gate.wait()
+    recorder.step('ホーム', at, at.run)
+    for _ in range(iterations):
+        at.text_input[0].input(keyword)
+        recorder.step('検索', at, lambda: at.button[0].click().run())
+        results = button_keys(at, 'search_btn_')
+        if results:
+            recorder.step('詳細', at, lambda: at.button(key=results[0]).click().run())
+            lines = button_keys(at, 'btn_item_')
+            if lines:
+                recorder.step('開く', at, lambda: at.button(key=lines[0]).click().run())
+                add = button_keys(at, 'add_cart_')
+                if add:
+                    recorder.step('カートに入れる', at, lambda: at.button(key=add[0]).click().run())
+
+        at.session_state.page = "cart"
+        recorder.step('カート', at, at.run)
+        if button_keys(at, 'cart_confirm_button'):
+            at.selectbox(key="cart_destination_select").set_value(site)
+            at.selectbox(key="cart_borrower_select").set_value(person)
+            recorder.step('持ち出し確定', at, lambda: at.button(key="cart_confirm_button").click().run())
+
+        at.session_state.page = "return_detail"
+        at.session_state.page_params = {'destination': site, 'person': person}
+        recorder.step('返却画面', at, at.run)
+        if button_keys(at, 'return_all_button'):
+            recorder.step('一括返却', at, lambda: at.button(key="return_all_button").click().run())
+        at.session_state.page = "home"
+        at.session_state.page_params = {}
+        recorder.step('ホーム', at, at.run)
+
+
+def run_level(app_path, sessions, iterations, timeout):
+    # 同時数ごとに偽シートとサービス（cache_resource）を作り直し、前の段の結果を持ち越さない
+    fake_backend.reset_shared()
+    st.cache_resource.clear()
+    recorder = SessionRecorder()
+    start_gate = threading.Barrier(sessions)
+    started = time.perf_counter()
+    with shared_runtime(), ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [pool.submit(run_session, app_path, i, iterations, recorder, start_gate, timeout)
+                   for i in range(sessions)]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                recorder.errors.append(f"セッション失敗: {e!r}")
+    wall = time.perf_counter() - started
+
+    calls = Counter()
+    for backend in fake_backend.shared_backends().values():
+        calls.update(backend.calls)
+    latencies = np.array([t for _, t in recorder.timings]) * 1000
+    by_step = pd.DataFrame(recorder.timings, columns=['操作', '秒']).groupby('操作')['秒'].quantile(0.95) * 1000
+    row = {
+        '同時セッション数': sessions,
+        '再実行回数': len(latencies),
+        'p50(ms)': np.percentile(latencies, 50) if len(latencies) else np.nan,
+        'p95(ms)': np.percentile(latencies, 95) if len(latencies) else np.nan,
+        'p99(ms)': np.percentile(latencies, 99) if len(latencies) else np.nan,
+        '再実行/秒': len(latencies) / wall,
+        'API呼び出し/秒': sum(calls.values()) / wall,
+        '最も遅い操作(p95)': f"{by_step.idxmax()} {by_step.max():.0f}ms" if not by_step.empty else '',
+        'エラー': len(recorder.errors),
+    }
+    row.update({f"{kind}/秒": count / wall for kind, count in sorted(calls.items())})
+    return row, recorder.errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="備品管理アプリの同時セッション負荷試験（偽のスプレッドシートを使用）")
+    parser.add_argument('--sessions', default='1,2,4,8', help="同時セッション数をカンマ区切りで（段階的に増やす）")
+    parser.add_argument('--iterations', type=int, default=3, help="1 セッションあたりの 検索→持ち出し→返却 の回数")
+    parser.add_argument('--latency', type=float, default=0.2, help="API 1 回あたりの待ち時間（秒）")
+    parser.add_argument('--jitter', type=float, default=0.05, help="待ち時間のばらつき（± 秒）")
+    parser.add_argument('--items', type=int, default=300, help="偽シートの品物数")
+    parser.add_argument('--timeout', type=float, default=60, help="1 回の再実行のタイムアウト（秒）")
+    parser.add_argument('--app', default=os.path.join(APP_DIR, 'zaikokanri.py'))
+    args = parser.parse_args(argv)
+
+    os.environ['ZAIKOKANRI_BACKEND'] = 'fake'
+    os.environ['ZAIKOKANRI_FAKE_LATENCY'] = str(args.latency)
+    os.environ['ZAIKOKANRI_FAKE_JITTER'] = str(args.jitter)
+    os.environ['ZAIKOKANRI_FAKE_ITEMS'] = str(args.items)
+
+    rows = []
+    for sessions in [int(s) for s in args.sessions.split(',') if s.strip()]:
+        row, errors = run_level(args.app, sessions, args.iterations, args.timeout)
+        rows.append(row)
+        print(f"同時 {sessions} セッション: p95 {row['p95(ms)']:.0f}ms / エラー {row['エラー']} 件", flush=True)
+        for error in errors[:5]:
+            print(f"  {error}")
+
+    report = pd.DataFrame(rows).fillna(0)
+    with pd.option_context('display.max_columns', None, 'display.width', 200, 'display.float_format', '{:.1f}'.format):
+        print(report.to_string(index=False))
+    return report
+
+
+if __name__ == '__main__':
+    main()
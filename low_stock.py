@@ -0,0 +1,52 @@
+# ✅ 在庫の少ない品物（発注点）の追跡
+# --- 読み込み時に 1 度だけ全品物を判定し、その後は持ち出し・返却・在庫調整で数の変わった品物だけを判定し直す ---
+
+import numpy as np
+import pandas as pd
+
+THRESHOLD_SHEET = "Thresholds"
+THRESHOLD_COLUMNS = ['日時', '品物ID', '発注点']
+
+
+def latest_thresholds(ledger):
+    # 品物ごとに最後に登録された発注点。空欄で登録し直した品物は発注点なしに戻す
+    if ledger.empty:
+        return pd.Series(dtype='float64')
+    values = pd.Series(pd.to_numeric(ledger['発注点'], errors='coerce').to_numpy(),
+                       index=ledger['品物ID'].astype(str).to_numpy())
+    return values[~values.index.duplicated(keep='last')].dropna()
+
+
+class LowStockTracker:
+    def __init__(self):
+        self._rows = np.array([], dtype='int64')
+        self._position = pd.Index([])
+        self._thresholds = np.array([], dtype='float64')
+        self.low = frozenset()
+
+    def rebuild(self, items, thresholds):
+        # 品物の行の並びと発注点を覚え直し、全品物を判定する
+        first = ~items['品物ID'].duplicated()
+        self._rows = np.flatnonzero(first.to_numpy())
+        self._position = pd.Index(items['品物ID'].to_numpy()[self._rows])
+        self._thresholds = thresholds.reindex(self._position).to_numpy(dtype='float64', copy=True)
+        remaining = items['残りの在庫数'].to_numpy()[self._rows]
+        self.low = frozenset(self._position[remaining <= self._thresholds])
+        return self.low
+
+    def set_thresholds(self, thresholds):
+        # thresholds: {品物ID: 発注点 or NaN}。判定は次の update で行う
+        positions = self._position.get_indexer(list(thresholds))
+        found = positions >= 0
+        self._thresholds[positions[found]] = np.asarray(list(thresholds.values()), dtype='float64')[found]
+
+    def update(self, items, item_ids):
+        # 数の変わった品物だけを判定し直す。品物の行の並びは読み込みのときから変わらない前提
+        ids = pd.Index(pd.unique(pd.Series(list(item_ids), dtype=object).astype(str)))
+        positions = self._position.get_indexer(ids)
+        positions = positions[positions >= 0]
+        remaining = items['残りの在庫数'].to_numpy()[self._rows[positions]]
+        now_low = remaining <= self._thresholds[positions]
+        changed = self._position[positions]
+        self.low = (self.low - set(changed[~now_low])) | set(changed[now_low])
+        return self.low
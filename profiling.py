@@ -0,0 +1,49 @@
+# ✅ 1 回の再実行を計測するプロファイラ（本番に近い環境で重い処理を探す）
+# --- 指定した回数だけページ関数を cProfile で動かし、.prof とページ名・データ量の記録を保存して上位の関数を表にする ---
+
+import cProfile
+import json
+import os
+import pstats
+import time
+
+import pandas as pd
+
+PROFILE_DIR = os.getenv('ZAIKOKANRI_PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+TOP_COLUMNS = ['関数', '場所', '呼び出し回数', '自身の秒', '累積の秒']
+# 1 回の計測指定で計測する表示の回数の上限（計測中の表示は遅くなり、.prof もその数だけ残る）
+MAX_RUNS = 20
+
+
+def top_functions(stats, limit=15):
+    # 累積時間の長い順。自分のコードと pandas の内部の両方が並ぶ
+    rows = []
+    for (path, line, func), (_, calls, own, total, _) in stats.stats.items():
+        rows.append([func, f"{os.path.basename(path)}:{line}", calls, own, total])
+    top = pd.DataFrame(rows, columns=TOP_COLUMNS).sort_values('累積の秒', ascending=False, kind='stable')
+    return top.head(limit).reset_index(drop=True)
+
+
+def profile_call(page, sizes, func, on_report):
+    # 画面移動（st.rerun）は例外で抜けてくるので、finally で計測を止めて保存・報告し、例外はそのまま投げ直す
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        on_report(save_profile(page, sizes, profiler, time.perf_counter() - started))
+
+
+def save_profile(page, sizes, profiler, elapsed, directory=PROFILE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    stamp = pd.Timestamp.now().strftime('%Y%m%d-%H%M%S-%f')
+    base = os.path.join(directory, f"{stamp}_{page}")
+    profiler.dump_stats(base + '.prof')
+    stats = pstats.Stats(profiler)
+    top = top_functions(stats)
+    meta = {'日時': stamp, 'ページ': page, '秒': round(elapsed, 4), 'データ量': sizes, 'ファイル': base + '.prof'}
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(dict(meta, 上位の関数=top.to_dict('records')), f, ensure_ascii=False, indent=1)
+    return dict(meta, 上位の関数=top)
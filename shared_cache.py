@@ -0,0 +1,144 @@
+# ✅ プロセス間で共有するキャッシュ（複数の Streamlit サーバーを並べて動かすとき用）
+# --- 倉庫ごとの読み込み結果・改訂番号・読み仮名を 1 つの SQLite ファイルに置き、
+#     どのプロセスが読み込んだ結果も同じ改訂番号の間は全プロセスで使い回す ---
+#
+# 中身は pickle なので、同じマシン上の信頼できるプロセスだけが読み書きする場所に置くこと
+
+import os
+import pickle
+import sqlite3
+import time
+import uuid
+from contextlib import closing, contextmanager
+
+# 保存する表の形を変えたら上げる（古い形の読み込み結果を使わないように）
+CACHE_FORMAT = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (key TEXT PRIMARY KEY, revision TEXT, loaded_at REAL, payload BLOB);
+CREATE TABLE IF NOT EXISTS revisions (key TEXT PRIMARY KEY, revision TEXT, checked_at REAL);
+CREATE TABLE IF NOT EXISTS yomi (text TEXT PRIMARY KEY, yomi TEXT);
+CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, holder TEXT, until REAL);
+"""
+
+
+class SharedCache:
+    def __init__(self, path, lease_seconds=30, busy_timeout=30):
+        # lease_seconds: 1 つのプロセスが読み込みを引き受けている間、他のプロセスが待つ最長の秒数
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.busy_timeout = busy_timeout
+        self.holder = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        # 接続はスレッドをまたいで使えないので、操作ごとに開いて閉じる（閉じれば途中のトランザクションは取り消される）
+        return closing(sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None))
+
+    # --- 改訂番号 ---
+    def revision(self, key, max_age, read):
+        # max_age 秒以内にどこかのプロセスが確認した改訂番号があればそれを返し、なければ read() で確認して残す
+        with self._connect() as db:
+            row = db.execute("SELECT revision, checked_at FROM revisions WHERE key = ?", (key,)).fetchone()
+        if row is not None and time.time() - row[1] <= max_age:
+            return row[0]
+        revision = read()
+        self.put_revision(key, revision)
+        return revision
+
+    def put_revision(self, key, revision):
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO revisions VALUES (?, ?, ?)", (key, revision, time.time()))
+
+    # --- 倉庫ごとの読み込み結果 ---
+    def shard(self, key, revision, max_age, fetch):
+        # 同じ改訂番号で max_age 秒以内に読み込まれた結果があれば使う。なければ 1 つのプロセスだけが fetch() し、
+        # 他のプロセスはその結果が保存されるのを待つ（待ちきれなければ自分で読む）
+        key = f"{CACHE_FORMAT}:{key}"
+        cached = self._cached_shard(key, revision, max_age)
+        if cached is not None:
+            return cached
+        leased = self._acquire(key)
+        try:
+            if leased:
+                cached = self._cached_shard(key, revision, max_age)
+                if cached is not None:
+                    return cached
+            shard = fetch()
+            self._store(key, shard)
+            return shard
+        finally:
+            if leased:
+                self._release(key)
+
+    @contextmanager
+    def lease(self, key):
+        # 他のプロセスと順番にする処理を囲む。lease_seconds 待っても空かなければ借りずに進める
+        # （落ちたプロセスの借用で書き込みが止まらないように。重なった分は呼び出し側の確認で弾く）
+        leased = self._acquire(f"lease:{key}")
+        try:
+            yield
+        finally:
+            if leased:
+                self._release(f"lease:{key}")
+
+    def _cached_shard(self, key, revision, max_age):
+        with self._connect() as db:
+            row = db.execute("SELECT revision, loaded_at, payload FROM shards WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] != revision or time.time() - row[1] > max_age:
+            return None
+        return pickle.loads(row[2])
+
+    def _store(self, key, shard):
+        payload = pickle.dumps(shard, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO shards VALUES (?, ?, ?, ?)",
+                       (key, shard['revision'], time.time(), sqlite3.Binary(payload)))
+
+    def _acquire(self, key):
+        # 期限切れの借用は他のプロセスが落ちたものとみなして奪う
+        deadline = time.time() + self.lease_seconds
+        while True:
+            with self._connect() as db:
+                db.execute("BEGIN IMMEDIATE")
+                now = time.time()
+                row = db.execute("SELECT until FROM leases WHERE key = ?", (key,)).fetchone()
+                if row is None or row[0] < now:
+                    db.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+                               (key, self.holder, now + self.lease_seconds))
+                    db.execute("COMMIT")
+                    return True
+                db.execute("COMMIT")
+            if time.time() > deadline:
+                return False
+            time.sleep(0.05)
+
+    def _release(self, key):
+        with self._connect() as db:
+            db.execute("DELETE FROM leases WHERE key = ? AND holder = ?", (key, self.holder))
+
+    # --- 読み仮名 ---
+    def yomi(self, texts, convert):
+        # {文字列: 読み仮名}。どのプロセスも変換していない文字列だけを convert() し、結果を残す
+        texts = [str(t) for t in dict.fromkeys(texts)]
+        table = {}
+        with self._connect() as db:
+            for start in range(0, len(texts), 500):
+                chunk = texts[start:start + 500]
+                marks = ','.join('?' * len(chunk))
+                table.update(db.execute(f"SELECT text, yomi FROM yomi WHERE text IN ({marks})", chunk).fetchall())
+            missing = [(t, convert(t)) for t in texts if t not in table]
+            if missing:
+                db.executemany("INSERT OR IGNORE INTO yomi VALUES (?, ?)", missing)
+                table.update(missing)
+        return table
+
+    def clear(self):
+        with self._connect() as db:
+            for name in ('shards', 'revisions', 'yomi', 'leases'):
+                db.execute(f"DELETE FROM {name}")
+
@@ -0,0 +1,87 @@
+# ✅ 在庫の履歴（イベント追記＋定期スナップショット）
+# --- 持ち出し・返却・破損を追記専用のイベントとして残し、任意の日時の在庫を「直前のスナップショット＋その後のイベント」で求める ---
+
+import pandas as pd
+
+EVENT_SHEET = "StockEvents"
+SNAPSHOT_SHEET = "StockSnapshots"
+EVENT_COLUMNS = ['日時', '種別', '品物ID', '在庫増減', '持ち出し増減', 'ログID', '備考']
+SNAPSHOT_COLUMNS = ['日時', '品物ID', '元の在庫数', '持ち出し中の在庫数']
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def now_str():
+    return pd.Timestamp.now().strftime(TIME_FORMAT)
+
+
+def _prepare(df, columns, numeric):
+    df = df.reindex(columns=columns + [c for c in df.columns if c not in columns]).copy()
+    df['時刻'] = pd.to_datetime(df['日時'], errors='coerce')
+    df['品物ID'] = df['品物ID'].astype(str)
+    if 'ログID' in df:
+        df['ログID'] = df['ログID'].astype(str)
+    for col in numeric:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+    return df
+
+
+class StockHistory:
+    def __init__(self, events, snapshots):
+        self.events = _prepare(events, EVENT_COLUMNS, ['在庫増減', '持ち出し増減'])
+        self.snapshots = _prepare(snapshots, SNAPSHOT_COLUMNS, ['元の在庫数', '持ち出し中の在庫数'])
+
+    def append_events(self, events):
+        self.events = pd.concat([self.events, _prepare(events, EVENT_COLUMNS, ['在庫増減', '持ち出し増減'])],
+                                ignore_index=True)
+
+    def append_snapshot(self, snapshot):
+        self.snapshots = pd.concat(
+            [self.snapshots, _prepare(snapshot, SNAPSHOT_COLUMNS, ['元の在庫数', '持ち出し中の在庫数'])],
+            ignore_index=True)
+
+    def replace_warehouse(self, warehouse, events, snapshots):
+        # 他のプロセスが追記した分を取り込むため、1 つの倉庫の分だけを読み直したものと入れ替える
+        self.events = pd.concat([self.events[self.events['倉庫'] != warehouse],
+                                 _prepare(events, EVENT_COLUMNS, ['在庫増減', '持ち出し増減'])], ignore_index=True)
+        self.snapshots = pd.concat(
+            [self.snapshots[self.snapshots['倉庫'] != warehouse],
+             _prepare(snapshots, SNAPSHOT_COLUMNS, ['元の在庫数', '持ち出し中の在庫数'])], ignore_index=True)
+
+    def snapshot_ids(self, warehouse):
+        # スナップショット（起点を含む）のある品物ID
+        return set(self.snapshots.loc[self.snapshots['倉庫'] == warehouse, '品物ID'])
+
+    def events_since_snapshot(self, warehouse):
+        # 品物ごとの最新のスナップショットのうち最も古いものより後のイベント数
+        # （後から増えた品物の起点だけを残したときに、数え直しにならないように）
+        snaps = self.snapshots[self.snapshots['倉庫'] == warehouse]
+        events = self.events[self.events['倉庫'] == warehouse]
+        if snaps.empty:
+            return len(events)
+        return int((events['時刻'] > snaps.groupby('品物ID')['時刻'].max().min()).sum())
+
+    def state_at(self, when, item_ids=None):
+        # 品物ごとに when 以前で最新のスナップショットを起点に、その後 when までのイベントだけを足し込む
+        when = pd.Timestamp(when)
+        snaps = self.snapshots[self.snapshots['時刻'] <= when]
+        if item_ids is not None:
+            snaps = snaps[snaps['品物ID'].isin([str(i) for i in item_ids])]
+        base = snaps.sort_values('時刻', kind='stable').groupby('品物ID').tail(1).set_index('品物ID')
+        if base.empty:
+            return pd.DataFrame(columns=['品物ID', '元の在庫数', '持ち出し中の在庫数', '残りの在庫数', '基準日時'])
+
+        events = self.events[self.events['品物ID'].isin(base.index) & (self.events['時刻'] <= when)]
+        events = events[events['時刻'] > events['品物ID'].map(base['時刻'])]
+        deltas = events.groupby('品物ID')[['在庫増減', '持ち出し増減']].sum()
+
+        state = pd.DataFrame({
+            '元の在庫数': base['元の在庫数'] + deltas['在庫増減'].reindex(base.index, fill_value=0),
+            '持ち出し中の在庫数': base['持ち出し中の在庫数'] + deltas['持ち出し増減'].reindex(base.index, fill_value=0),
+            '基準日時': base['日時'],
+        })
+        state['残りの在庫数'] = state['元の在庫数'] - state['持ち出し中の在庫数']
+        return state.rename_axis('品物ID').reset_index()[
+            ['品物ID', '元の在庫数', '持ち出し中の在庫数', '残りの在庫数', '基準日時']]
+
+    def item_events(self, item_id):
+        return self.events[self.events['品物ID'] == str(item_id)].sort_values('時刻')[EVENT_COLUMNS]
@@ -0,0 +1,75 @@
+# 複数のプロセス（InventoryService）が同じシートに同時に持ち出しを登録しても、在庫を超えず・ログID が重ならないこと
+
+import threading
+
+import pandas as pd
+import pytest
+
+from fake_backend import FakeSheetsBackend
+from inventory_service import (CHECKOUT_COLUMNS, CHECKOUT_SHEET, FAVORITE_COLUMNS, FAVORITE_SHEET, ITEMS_SHEET,
+                               LIST_SHEET, RETURNED_COL, InventoryService, StockConflictError)
+from shared_cache import SharedCache
+
+
+def small_tables():
+    return {
+        ITEMS_SHEET: [['品物ID', '品物名', '詳細', '元の在庫数'], [1, '電動ドリル', 'マキタ 18V', 3], [2, '脚立', '3段', 5]],
+        CHECKOUT_SHEET: [list(CHECKOUT_COLUMNS)],
+        LIST_SHEET: [['持ち出し先', '持ち出し者'], ['A現場', '田中']],
+        FAVORITE_SHEET: [list(FAVORITE_COLUMNS)],
+    }
+
+
+def run_race(services, attempts=8):
+    barrier = threading.Barrier(attempts)
+    results, errors = [], []
+
+    def worker(service):
+        barrier.wait()
+        try:
+            results.append(service.checkout({'1': 1}, 'A現場', '田中', '2026-10-19', '2026-10-20').log_ids)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(services[i % len(services)],)) for i in range(attempts)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def sheet_log(backend):
+    header, *rows = backend.tables[CHECKOUT_SHEET]
+    log = pd.DataFrame([row + [''] * (len(header) - len(row)) for row in rows], columns=header)
+    log['行番号'] = log.index + 2
+    return log
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_concurrent_checkouts_from_several_instances(tmp_path, shared):
+    backend = FakeSheetsBackend(small_tables(), latency=0.005, jitter=0.004, seed=1)
+    cache = SharedCache(str(tmp_path / 'cache.sqlite')) if shared else None
+    services = [InventoryService(backend, shared_cache=cache) for _ in range(4)]
+    for service in services:
+        service.snapshot()
+
+    results, errors = run_race(services)
+
+    log = sheet_log(backend)
+    active = log[(log[RETURNED_COL].astype(str) != 'TRUE') & (log['品物ID'].astype(str) == '1')]
+    # 在庫 3 を超えて持ち出し中にならない
+    assert pd.to_numeric(active['持ち出し数']).sum() <= 3
+    # 成功した持ち出しだけが持ち出し中として残り、そのログID はシート上で最初に出てくる行
+    log_ids = [str(i) for ids in results for i in ids]
+    assert len(log_ids) == len(active) == len(set(log_ids))
+    first_row = log.drop_duplicates('ログID').set_index(log['ログID'].drop_duplicates().astype(str))['行番号']
+    assert sorted(first_row[log_ids]) == sorted(active['行番号'])
+    assert len(results) + len(errors) == 8
+    assert all(isinstance(e, StockConflictError) for e in errors), errors
+    if shared:
+        # 借用で順番になるので、取り消しもやり直しもなく在庫の数だけ成功する
+        assert len(results) == 3 and len(log) == 3
+
+    fresh = InventoryService(backend).snapshot().items.set_index('品物ID')
+    assert fresh.loc['1', '残りの在庫数'] >= 0
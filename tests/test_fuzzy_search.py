@@ -0,0 +1,26 @@
+# あいまい検索: 読み仮名と詳細を別々に採点すること、短い名前の 1 文字の入力ミスでも見つかること
+
+from fuzzy_search import FuzzyIndex
+
+YOMI = ['まるのこ', 'ばーる', 'でんどうどりる', 'きゃたつ']
+DETAIL = ['HiKOKI 3型', 'マキタ 6型', 'マキタ 93型', 'ハタヤ 22型']
+
+
+def names(keyword):
+    order, _, _ = FuzzyIndex(YOMI, DETAIL).search([(keyword, keyword)])
+    return [YOMI[i] for i in order]
+
+
+def test_fields_are_scored_separately():
+    # 「まる」の頭（詳細のマキタ）と終わり（読み仮名のばーる）が足し合わされないこと
+    assert names('まる') == ['まるのこ']
+
+
+def test_single_kana_typo_in_short_name():
+    assert names('どりら')[0] == 'でんどうどりる'
+    assert names('どらる')[0] == 'でんどうどりる'
+    assert names('きゃだつ')[0] == 'きゃたつ'
+
+
+def test_two_kana_keyword_needs_exact_match():
+    assert names('まろ') == []
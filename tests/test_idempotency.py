@@ -0,0 +1,63 @@
+# 主の書き込みの後（改訂番号・履歴）で失敗しても、同じ送信キーでやり直したときに二重に書き込まないこと
+
+import pandas as pd
+import pytest
+
+from fake_backend import FakeSheetsBackend
+from inventory_service import ADJUSTMENT_SHEET, CHECKOUT_SHEET, InventoryService
+from stock_history import EVENT_SHEET
+from test_checkout_race import small_tables
+
+
+class FlakyBackend(FakeSheetsBackend):
+    # fail に入れた呼び出しを 1 回だけ失敗させる（Sheets の 429 の代わり）
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail = set()
+
+    def _maybe_fail(self, kind):
+        if kind in self.fail:
+            self.fail.discard(kind)
+            raise RuntimeError(f"429: {kind}")
+
+    def bump_revision(self):
+        self._maybe_fail('bump_revision')
+        return super().bump_revision()
+
+    def append_rows(self, name, rows):
+        self._maybe_fail(f'append_rows:{name}')
+        return super().append_rows(name, rows)
+
+
+@pytest.mark.parametrize('failing', ['bump_revision', f'append_rows:{EVENT_SHEET}'])
+def test_checkout_retry_after_follow_up_failure(failing):
+    backend = FlakyBackend(small_tables())
+    service = InventoryService(backend)
+    service.snapshot()
+    backend.fail.add(failing)
+    with pytest.raises(RuntimeError):
+        service.checkout({'1': 1}, 'A現場', '田中', '2026-10-19', '2026-10-20', idempotency_key='k1')
+    result = service.checkout({'1': 1}, 'A現場', '田中', '2026-10-19', '2026-10-20', idempotency_key='k1')
+
+    assert result.repeated and result.log_ids == [1]
+    assert len(backend.tables[CHECKOUT_SHEET]) == 2
+    assert len(backend.tables[EVENT_SHEET]) == 2
+    assert service.snapshot().items.set_index('品物ID').loc['1', '持ち出し中の在庫数'] == 1
+    assert InventoryService(backend).stock_at(pd.Timestamp.now())['持ち出し中の在庫数'].sum() == 1
+
+
+@pytest.mark.parametrize('failing', ['bump_revision', f'append_rows:{ADJUSTMENT_SHEET}', f'append_rows:{EVENT_SHEET}'])
+def test_return_retry_after_follow_up_failure(failing):
+    backend = FlakyBackend(small_tables())
+    service = InventoryService(backend)
+    service.checkout({'1': 2}, 'A現場', '田中', '2026-10-19', '2026-10-20')
+    backend.fail.add(failing)
+    with pytest.raises(RuntimeError):
+        service.return_items({'1': {'返却数量': 1, '破損数量': 1}}, idempotency_key='k2')
+    service.return_items({'1': {'返却数量': 1, '破損数量': 1}}, idempotency_key='k2')
+
+    assert len(backend.tables[ADJUSTMENT_SHEET]) == 2
+    assert len(backend.tables[EVENT_SHEET]) == 4
+    items = service.snapshot().items.set_index('品物ID')
+    assert items.loc['1', '元の在庫数'] == 2 and items.loc['1', '持ち出し中の在庫数'] == 0
+    assert service.submissions.repeats == 1
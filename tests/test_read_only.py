@@ -0,0 +1,53 @@
+# スナップショットの表（全セッションで共有）は、どの書き換え方でもその場では変わらないこと
+
+import pandas as pd
+import pytest
+
+from fake_backend import FakeSheetsBackend
+from inventory_service import InventoryService
+from test_checkout_race import small_tables
+
+WRITES = {
+    'setitem': lambda df: df.__setitem__('x', 1),
+    'delitem': lambda df: df.__delitem__('品物名'),
+    'insert': lambda df: df.insert(0, 'x', 1),
+    'pop': lambda df: df.pop('品物名'),
+    'update': lambda df: df.update(df),
+    'loc': lambda df: df.loc.__setitem__((0, '元の在庫数'), 999),
+    'iloc': lambda df: df.iloc.__setitem__((0, 0), 999),
+    'at': lambda df: df.at.__setitem__((0, '元の在庫数'), 999),
+    'iat': lambda df: df.iat.__setitem__((0, 0), 999),
+    'rename': lambda df: df.rename(columns={'品物名': 'x'}, inplace=True),
+    'sort_values': lambda df: df.sort_values('元の在庫数', ascending=False, inplace=True),
+    'drop': lambda df: df.drop(index=0, inplace=True),
+    'fillna': lambda df: df.fillna(0, inplace=True),
+    'set_index': lambda df: df.set_index('品物ID', inplace=True),
+    'reset_index': lambda df: df.reset_index(drop=True, inplace=True),
+    'columns': lambda df: setattr(df, 'columns', [f"c{i}" for i in range(len(df.columns))]),
+    'index': lambda df: setattr(df, 'index', range(10, 10 + len(df))),
+}
+
+
+@pytest.fixture(scope='module')
+def snap():
+    return InventoryService(FakeSheetsBackend(small_tables())).snapshot()
+
+
+@pytest.mark.parametrize('name', list(WRITES))
+def test_shared_frames_refuse_writes(snap, name):
+    before = pd.DataFrame(snap.items).copy()
+    with pytest.raises(TypeError):
+        WRITES[name](snap.items)
+    assert pd.DataFrame(snap.items).equals(before)
+
+
+def test_reads_and_copies_still_work(snap):
+    items = snap.items
+    assert items.loc[0, '品物ID'] == '1' and items.iat[0, 0] == '1'
+    assert type(items[items['元の在庫数'] > 3]) is pd.DataFrame
+    renamed = items.rename(columns={'品物名': 'x'})
+    assert 'x' in renamed and '品物名' in items
+    copy = items.copy()
+    copy.loc[0, '元の在庫数'] = 999
+    copy.sort_values('元の在庫数', inplace=True)
+    assert items.loc[0, '元の在庫数'] != 999
@@ -0,0 +1,20 @@
+# 検索結果のキャッシュ: 持ち出しでは捨てず、品物の表が変わったときだけ作り直すこと
+
+from fake_backend import FakeSheetsBackend
+from inventory_service import ITEMS_SHEET, InventoryService
+from test_checkout_race import small_tables
+
+
+def test_checkout_keeps_search_cache():
+    backend = FakeSheetsBackend(small_tables())
+    service = InventoryService(backend)
+    ids = service.search_ids(['ドリル'], fuzzy=True)
+    service.checkout({'1': 1}, 'A現場', '田中', '2026-10-19', '2026-10-20')
+    hits = service.search_cache.hits
+    assert service.search_ids(['ドリル'], fuzzy=True) == ids
+    assert service.search_cache.hits == hits + 1
+
+    backend.tables[ITEMS_SHEET].append([99, '充電ドリル', 'マキタ 10.8V', 2])
+    service.load()
+    ids, _ = service.search_ids(['ドリル'], fuzzy=True)
+    assert '99' in ids
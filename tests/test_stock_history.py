@@ -0,0 +1,53 @@
+# 在庫の履歴: 後から増えた品物も履歴に入ること・持ち出し 1 回の API 呼び出しが増えないこと
+# （自分の書き込みは読み直さず、他の人の書き込みだけ読み直すこと）
+
+import pandas as pd
+
+from fake_backend import FakeSheetsBackend
+from inventory_service import ITEMS_SHEET, InventoryService
+from test_checkout_race import small_tables
+
+
+def checkout(service, item_id, qty=1):
+    return service.checkout({item_id: qty}, 'A現場', '田中', '2026-10-19', '2026-10-20')
+
+
+def test_item_added_after_first_event_is_in_history():
+    backend = FakeSheetsBackend(small_tables())
+    service = InventoryService(backend, snapshot_every=3)
+    checkout(service, '1')
+    backend.tables[ITEMS_SHEET].append([99, 'ハンマー', '大', 10])
+    service.load()
+    for _ in range(5):
+        checkout(service, '99')
+
+    state = service.stock_at(pd.Timestamp.now()).set_index('品物ID')
+    assert state.loc['99', '持ち出し中の在庫数'] == 5 and state.loc['99', '元の在庫数'] == 10
+    assert state.loc['1', '持ち出し中の在庫数'] == 1
+    # 別のプロセスが履歴をシートから読んでも同じ
+    fresh = InventoryService(backend).stock_at(pd.Timestamp.now()).set_index('品物ID')
+    assert fresh.loc[['1', '99'], '持ち出し中の在庫数'].tolist() == [1, 5]
+
+
+def test_checkout_api_calls():
+    backend = FakeSheetsBackend(small_tables())
+    service = InventoryService(backend, ttl=0, snapshot_every=200)
+    checkout(service, '1')
+    backend.reset_calls()
+    checkout(service, '2')
+    service.snapshot()
+    # 持ち出し中の読み直しと追記後の確認・CheckoutLog と StockEvents の追記・改訂番号だけ。
+    # 自分の書き込みは次の確認で読み直さない
+    calls = dict(backend.calls)
+    assert calls.pop('read_revision') > 0
+    assert calls == {'read_columns': 2, 'append_rows': 2, 'bump_revision': 1}
+
+
+def test_other_writer_is_reloaded():
+    backend = FakeSheetsBackend(small_tables())
+    service = InventoryService(backend, ttl=0)
+    checkout(service, '1')
+    checkout(InventoryService(backend, ttl=0), '1')
+    backend.reset_calls()
+    assert service.snapshot().items.set_index('品物ID').loc['1', '持ち出し中の在庫数'] == 2
+    assert backend.calls['read_records'] > 0
@@ -5,67 +5,75 @@ import streamlit as st
 import pandas as pd
 import gspread
 import os
+import re
 import json
 import unicodedata
-import pykakasi
+import uuid
 from datetime import datetime, date
 from google.oauth2.service_account import Credentials
-
-# --- ふりがな変換セットアップ ---
-kakasi = pykakasi.kakasi()
-kakasi.setMode("J", "H")
-kakasi.setMode("K", "H")
-kakasi.setMode("H", "H")
-converter = kakasi.getConverter()
-
-def get_yomi(text):
-    return converter.do(text)
-
-# --- 認証処理（Cloud or ローカル自動判定） ---
-creds_json = os.getenv('GOOGLE_CREDENTIALS')
-if creds_json:
-    creds_info = json.loads(creds_json)
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from inventory_service import InventoryService, SheetsBackend, StockConflictError, ReturnValidationError, deep_size
+from profiling import MAX_RUNS, profile_call
+from shared_cache import SharedCache
+
+# --- バックエンドの選択（ZAIKOKANRI_BACKEND=fake で Google に接続せずプロセス内の偽シートを使う。負荷試験用）---
+BACKEND = os.getenv('ZAIKOKANRI_BACKEND', 'sheets')
+if BACKEND == 'fake':
+    import fake_backend
 else:
-    local_path = "C:/Users/k_uemura/Desktop/zaikokanri/toumei/credentials.json"
-    if os.path.exists(local_path):
-        with open(local_path, "r", encoding="utf-8") as f:
-            creds_info = json.load(f)
+    # --- 認証処理（Cloud or ローカル自動判定） ---
+    creds_json = os.getenv('GOOGLE_CREDENTIALS')
+    if creds_json:
+        creds_info = json.loads(creds_json)
     else:
-        st.error("認証情報が見つかりません")
-        st.stop()
-
-SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive'
-]
-creds = Credentials.from_service_account_info(creds_info, scopes=SCOPES)
-gc = gspread.authorize(creds)
+        local_path = "C:/Users/k_uemura/Desktop/zaikokanri/toumei/credentials.json"
+        if os.path.exists(local_path):
+            with open(local_path, "r", encoding="utf-8") as f:
+                creds_info = json.load(f)
+        else:
+            st.error("認証情報が見つかりません")
+            st.stop()
+
+    SCOPES = [
+        'https://www.googleapis.com/auth/spreadsheets',
+        'https://www.googleapis.com/auth/drive'
+    ]
+    creds = Credentials.from_service_account_info(creds_info, scopes=SCOPES)
+    gc = gspread.authorize(creds)
+
 SPREADSHEET_NAME = "zaikokanri"
 
-@st.cache_data(ttl=20)
-def load_sheet_data():
-    spreadsheet = gc.open(SPREADSHEET_NAME)
-    items_df = pd.DataFrame(spreadsheet.worksheet("Items").get_all_records())
-    checkout_df = pd.DataFrame(spreadsheet.worksheet("CheckoutLog").get_all_records())
-    list_df = pd.DataFrame(spreadsheet.worksheet("List").get_all_records())
-    favorite_df = pd.DataFrame(spreadsheet.worksheet("favorite").get_all_records())  # ✅追加
-    items_df = items_df[items_df['品物名'].notna() & (items_df['品物名'] != '')]
-    return items_df, checkout_df, list_df, favorite_df
-
-
-def calculate_remaining_stock(items, checkout):
-    items['品物ID'] = items['品物ID'].astype(str)
-    checkout['品物ID'] = checkout['品物ID'].astype(str)
-    items['元の在庫数'] = pd.to_numeric(items['元の在庫数'], errors='coerce').fillna(0).astype(int)
-    checkout['持ち出し数'] = pd.to_numeric(checkout['持ち出し数'], errors='coerce').fillna(0).astype(int)
-    not_returned = checkout[checkout['返却済み（TRUE/FALSE）'].astype(str).str.upper() != 'TRUE']
-    merged = not_returned.merge(items[['品物ID', '品物名']], on='品物ID', how='left')
-    checked_out = merged.groupby('品物ID')['持ち出し数'].sum().reset_index()
-    checked_out.rename(columns={'持ち出し数': '持ち出し中の在庫数'}, inplace=True)
-    items = items.merge(checked_out, on='品物ID', how='left')
-    items['持ち出し中の在庫数'] = items['持ち出し中の在庫数'].fillna(0).astype(int)
-    items['残りの在庫数'] = items['元の在庫数'] - items['持ち出し中の在庫数']
-    return items
+# --- 倉庫ごとのスプレッドシート（例: ZAIKOKANRI_WAREHOUSES="本社=zaikokanri,北倉庫=zaikokanri_kita"）---
+WAREHOUSES = dict(
+    [part.strip() for part in entry.split('=', 1)] if '=' in entry else (entry.strip(), entry.strip())
+    for entry in os.getenv('ZAIKOKANRI_WAREHOUSES', SPREADSHEET_NAME).split(',') if entry.strip()
+)
+
+@st.cache_resource
+def get_service():
+    # プロセス内で 1 つだけ作り、全セッションで共有する
+    if BACKEND == 'fake':
+        backends = {name: fake_backend.shared_backend(sheet) for name, sheet in WAREHOUSES.items()}
+    else:
+        backends = {name: SheetsBackend(gc, sheet) for name, sheet in WAREHOUSES.items()}
+    # 複数のサーバープロセスで動かすときは ZAIKOKANRI_SHARED_CACHE に共有する SQLite ファイルを指定する
+    shared_path = os.getenv('ZAIKOKANRI_SHARED_CACHE')
+    shared = SharedCache(shared_path) if shared_path else None
+    # 5 秒ごとに改訂番号だけを確認し、変わったときだけ読み直す（シートの直接編集は 10 分ごとの全体読み直しで反映）
+    return InventoryService(backends, ttl=5, max_age=600, shared_cache=shared)
+
+service = get_service()
+
+def session_memory():
+    # このセッションだけが持っているデータ（カート・検索結果の ID・入力中の値など）のバイト数
+    return deep_size(st.session_state.to_dict())
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
 
 def go_to(page, **kwargs):
     st.session_state.page = page
@@ -75,7 +83,7 @@ def show_favorites():
     st.title("⭐ いつものカート（現場別）")
     st.info("📌 現場ごとに過去に登録した品物を一括で持ち出し登録できます")
 
-    favorites_df = st.session_state.favorite_df
+    favorites_df = favorite_df
     if favorites_df.empty:
         st.info("定型カートがまだ登録されていません。")
     else:
@@ -100,18 +108,11 @@ def show_favorites_detail():
         return
 
     st.title(f"⭐ {site} の定型カート")
-    df = st.session_state.favorite_df  # ✅ 読み込み済
-    site_df = df[df['持ち出し先'] == site]
-
-    # メモ単位でグルーピング
-    grouped = site_df.groupby('メモ')[['品物ID', '数量']].apply(lambda x: x.to_dict('records')).reset_index(name='items')
-
-    for _, row in grouped.iterrows():
-        memo = row['メモ']
+    # メモ単位の一覧は版ごとに作った索引から引く
+    for memo in service.favorite_memos(site):
         col1, col2 = st.columns([3, 1])
         with col1:
             if st.button(memo, key=f"fav_btn_{memo}"):
-                st.session_state.favorite_cart = row['items']
                 st.session_state.favorite_site = site
                 st.session_state.favorite_memo = memo
                 go_to("favorite_use")
@@ -130,19 +131,21 @@ def show_favorites_detail():
 
 def show_favorite_use():
     st.title(f"📦 {st.session_state.favorite_site} - {st.session_state.favorite_memo}")
-    items = st.session_state.favorite_cart
+    # 全行をまとめて品物に結び付け、今の残りの在庫数と比べる
+    lines = service.resolve_template(st.session_state.favorite_site, st.session_state.favorite_memo)
     cart_preview = {}
 
-    for entry in items:
-        item_id = str(entry['品物ID'])
-        qty = int(entry['数量'])
-        item_row = st.session_state.items_df[st.session_state.items_df['品物ID'] == item_id]
-        if not item_row.empty:
-            item = item_row.iloc[0]
-            name = item['品物名']
-            detail = item['詳細']
-            st.write(f"✅ {name}（{detail}）: {qty}個")
-            cart_preview[item_id] = qty
+    for line in lines.itertuples(index=False):
+        if not line.見つかった:
+            st.write(f"❔ 品物ID {line.品物ID} は在庫一覧にありません（カートには入りません）")
+        elif line.不足:
+            st.warning(f"⚠️ {line.品物名}（{line.詳細}）: {line.数量}個 / 残り {line.残りの在庫数}個")
+            cart_preview[line.品物ID] = line.数量
+        else:
+            st.write(f"✅ {line.品物名}（{line.詳細}）: {line.数量}個 / 残り {line.残りの在庫数}個")
+            cart_preview[line.品物ID] = line.数量
+    if lines['不足'].any():
+        st.caption("⚠️ の品物は今の残りの在庫数より多く登録されています。カートで数量を確認してください。")
 
     col1, col2, col3 = st.columns(3)
 
@@ -162,20 +165,9 @@ def show_favorite_use():
         if st.button("🗑 削除", key=f"delete_{st.session_state.favorite_memo}"):
             site = st.session_state.favorite_site
             memo = st.session_state.favorite_memo
-            df = st.session_state.favorite_df
-
-            # 対象行削除
-            new_df = df[~((df['持ち出し先'] == site) & (df['メモ'] == memo))].copy()
 
-            # データベース反映
-            spreadsheet = gc.open(SPREADSHEET_NAME)
-            ws = spreadsheet.worksheet("favorite")
-            ws.clear()
-            ws.append_row(new_df.columns.tolist())
-            if not new_df.empty:
-                ws.append_rows(new_df.values.tolist())
-
-            st.session_state.favorite_df = new_df
+            # 対象行削除・データベース反映
+            service.delete_favorite(site, memo)
             st.success(f"✅ 「{memo}」を削除しました")
 
             # いつものページに戻る
@@ -196,45 +188,11 @@ def show_favorite_use():
 
 
 def register_favorite(site, memo, cart):
-    new_entries = []
-    for item_id, qty in cart.items():
-        new_entries.append({
-            '持ち出し先': site,
-            '品物ID': int(item_id),  # ✅ 数値として保持
-            '数量': qty,
-            'メモ': memo
-        })
-
-    df = pd.DataFrame(new_entries)[['持ち出し先', '品物ID', '数量', 'メモ']]
-    favorites_df = st.session_state.favorite_df
-
-    # ✅ 比較用に一時的に文字列型に変換したコピーを使う
-    df_str = df.copy()
-    favorites_str = favorites_df.copy()
-
-    # 共通列で型を str に統一して比較
-    common_cols = list(set(df.columns) & set(favorites_df.columns))
-    for col in common_cols:
-        df_str[col] = df_str[col].astype(str)
-        favorites_str[col] = favorites_str[col].astype(str)
-
-    # ✅ 重複チェック（比較は文字列、登録は数値のまま）
-    if not df.empty and common_cols:
-        merged = df_str.merge(favorites_str, how='inner', on=common_cols)
-        if len(merged) == len(df_str) and merged.equals(df_str):
-            st.info("✅ すでに同じ内容で登録されています")
-            return
-
-    # ✅ 登録処理（元のdfを使用）
-    spreadsheet = gc.open(SPREADSHEET_NAME)
-    ws = spreadsheet.worksheet("favorite")
-    ws.append_rows(df.values.tolist())
+    if not service.register_favorite(site, memo, cart):
+        st.info("✅ すでに同じ内容で登録されています")
+        return
     st.success("登録しました")
 
-    # ✅ セッション内の favorite_df を更新
-    updated_favorite_df = pd.DataFrame(ws.get_all_records())
-    st.session_state.favorite_df = updated_favorite_df
-
 
 
 
@@ -242,42 +200,32 @@ import streamlit.components.v1 as components
 
 def show_home():
     st.title("🏠 備品管理システム")
+    # 発注点以下の品物は書き込みのたびに更新された件数を見るだけなので、表示のたびの集計はない
+    if snapshot.low_stock:
+        st.warning(f"📉 発注点以下の品物が {len(snapshot.low_stock)} 件あります。")
+        if st.button("📉 在庫の少ない品物を見る", key="low_stock_nav"):
+            go_to("low_stock")
+            st.rerun()
     with st.form("search_form"):
         keyword_input = st.text_input("🔍 在庫検索（品物名または詳細を入力、スペース区切り可）").strip()
         search_mode = st.radio("検索モードを選択", ["AND", "OR"], horizontal=True)
+        fuzzy = st.checkbox("あいまい検索（入力ミス・表記ゆれも一致度順に表示）")
         submitted = st.form_submit_button("🔍 検索")
 
-    matched_items = pd.DataFrame()
     if submitted and keyword_input:
-        keywords = keyword_input.split()
-        keywords_hira = [get_yomi(k) for k in keywords]
-        items_df['読み仮名'] = items_df['品物名'].apply(get_yomi)
-        if any(len(k) >= 3 for k in keywords_hira):
-            targets = [k for k in keywords_hira if len(k) >= 3]
-            def name_match_func(yomi):
-                return all(k in yomi for k in targets) if search_mode == "AND" else any(k in yomi for k in targets)
-            name_match = items_df[items_df['読み仮名'].apply(name_match_func)]
-            matched_items = pd.concat([matched_items, name_match])
-        if any(len(k) >= 2 for k in keywords):
-            targets = [k for k in keywords if len(k) >= 2]
-            def detail_match_func(detail):
-                detail = str(detail)
-                return all(k in detail for k in targets) if search_mode == "AND" else any(k in detail for k in targets)
-            detail_match = items_df[items_df['詳細'].apply(detail_match_func)]
-            matched_items = pd.concat([matched_items, detail_match])
-        matched_items = matched_items.drop_duplicates(subset=['品物ID'])
-        st.session_state.matched_items = matched_items
+        # セッションには一致した品物ID だけを持たせる
+        st.session_state.matched_ids = service.search_ids(keyword_input.split(), search_mode, fuzzy)
         st.session_state.search_triggered = True
         st.rerun()
 
-    if st.session_state.get("search_triggered") and 'matched_items' in st.session_state:
-        matched_items = st.session_state.matched_items
-        if not matched_items.empty:
-            grouped = matched_items.groupby('品物名')['品物ID'].apply(list).reset_index()
+    if st.session_state.get("search_triggered") and 'matched_ids' in st.session_state:
+        ids, scores = st.session_state.matched_ids
+        # あいまい検索の結果は一致度順のまま、それ以外は読み仮名順に品物名でまとめる
+        grouped = service.group_matches(ids, ranked=scores is not None)
+        if grouped:
             st.subheader(f"🔎 検索結果（{len(grouped)}件）")
-            for _, row in grouped.iterrows():
-                group_name = row['品物名']
-                unique_id = str(row['品物ID'][0])
+            for group_name, group_ids in grouped:
+                unique_id = str(group_ids[0])
                 if st.button(f"{group_name}", key=f"search_btn_{group_name}_{unique_id}"):
                     st.session_state.selected_item = unique_id
                     st.session_state.search_triggered = False
@@ -301,28 +249,37 @@ def show_home():
         if st.button("⭐ いつもの"):
             go_to("favorites")
             st.rerun()
+    if st.button("📊 延滞・稼働率の分析"):
+        go_to("analytics")
+        st.rerun()
+    if st.button("📥 まとめて入力（ID 貼り付け・スキャン）", key="bulk_entry_nav"):
+        go_to("bulk_entry")
+        st.rerun()
 
     st.write(f"使用上の留意点。")
     st.write(f"在庫一覧は参考です。必ず在庫があるとは限りません。現物確認とキープは必須です。")
     st.write(f"一定の時間が経つとカート内の品物は消えます。カートに入れたら早めに持ち出し登録してください。")
     st.write(f"返却時に壊れたりしたものを在庫数量減少させる登録ができますが、ユーザーが増やす登録はできないので取り扱いに注意してください。")  
     st.write(f"いつもの。への登録はカートから行うことが出来ますが、工事名登録を行う際「定期整備」など大枠にして「〇〇年」等はつけないことをお勧めします。")
+
+    stats = service.search_cache.stats()
+    st.caption(f"検索キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']}（ヒット率 {stats['hit_rate']:.0%}、{stats['size']}/{stats['maxsize']} 件）")
+    st.caption(f"このセッションのデータ: {format_bytes(session_memory())} / 全セッション共有の表: {format_bytes(sum(service.shared_memory().values()))}")
            
 
 
 def show_list():
     st.title("📋 在庫一覧")
-    grouped = items_df.groupby('品物名')['品物ID'].apply(list).reset_index()
-    grouped['読み'] = grouped['品物名'].apply(get_yomi)
-    grouped = grouped.sort_values('読み').reset_index(drop=True)
-    for i in range(0, len(grouped), 4):
+    # 品物名ごとのまとまり（読み仮名順）は版ごとに 1 度だけ作り、全セッションで共有する
+    groups = service.item_groups()
+    for i in range(0, len(groups), 4):
         cols = st.columns(4)
         for j in range(4):
-            if i + j < len(grouped):
-                row = grouped.iloc[i + j]
+            if i + j < len(groups):
+                group_name, group_ids = groups[i + j]
                 with cols[j]:
-                    if st.button(row['品物名'], key=f"list_btn_{row['品物名']}"):
-                        st.session_state.selected_item = row['品物ID'][0]
+                    if st.button(group_name, key=f"list_btn_{group_name}"):
+                        st.session_state.selected_item = group_ids[0]
                         go_to("list_detail")
                         st.rerun()
     if st.button("🔙 ホームに戻る"):
@@ -340,44 +297,17 @@ def show_list_detail():
             go_to("home")
             st.rerun()
         return
-    selected_item_id = str(selected_item_id)
-    items_df['品物ID'] = items_df['品物ID'].astype(str)
-    if selected_item_id not in items_df['品物ID'].values:
-        st.error("❌ items_df に selected_item が存在しません")
-        if st.button("🔙 ホームに戻る"):
-            go_to("home")
-            st.rerun()
-        return
-    item_row = items_df[items_df['品物ID'] == selected_item_id]
-    if item_row.empty:
+    # 同じ品物名の品物ID は版ごとに作った索引から引く
+    group_name, group_ids = service.group_members(selected_item_id)
+    if group_name is None:
         st.write("品物が見つかりません。")
         if st.button("🔙 ホームに戻る"):
             go_to("home")
             st.rerun()
         return
-    group_name = item_row.iloc[0]['品物名']
-    group_items = items_df[items_df['品物名'] == group_name]
+    group_items = service.items_by_ids(group_ids)
     for _, item in group_items.iterrows():
-        detail_info = item.get('詳細', str(item['品物ID']))
-        item_key = f"item_{item['品物ID']}"
-        btn_label = f"【{detail_info}】 元の在庫数: {item['元の在庫数']} / 持ち出し中: {item['持ち出し中の在庫数']} / 残り: {item['残りの在庫数']}"
-        if st.button(btn_label, key=f"btn_{item_key}"):
-            if item['品物ID'] in st.session_state.expanded_items:
-                st.session_state.expanded_items.remove(item['品物ID'])
-            else:
-                st.session_state.expanded_items.add(item['品物ID'])
-            st.rerun()
-        if item['品物ID'] in st.session_state.expanded_items:
-            max_qty = item['残りの在庫数']
-            if max_qty <= 0:
-                st.write("在庫なし")
-            else:
-                qty = st.number_input(f"数量を選択 ({detail_info})", min_value=1, max_value=max_qty, key=f"qty_{item['品物ID']}")
-                if st.button(f"カートに入れる ({detail_info})", key=f"add_cart_{item['品物ID']}"):
-                    cart = st.session_state.get('cart', {})
-                    cart[item['品物ID']] = cart.get(item['品物ID'], 0) + qty
-                    st.session_state.cart = cart
-                    st.success(f"{detail_info} をカートに {qty} 個追加しました。")
+        list_detail_line(item)
         st.markdown("---")
     if st.button("🛒 カートを見る"):
         go_to("cart")
@@ -386,35 +316,137 @@ def show_list_detail():
         go_to("home")
         st.rerun()
 
+# --- 開閉ボタン・数量入力は fragment 内だけで再実行する ---
+@st.fragment
+def list_detail_line(item):
+    detail_info = item.get('詳細', str(item['品物ID']))
+    if service.multi:
+        detail_info = f"{item['倉庫']} / {detail_info}"
+    item_key = f"item_{item['品物ID']}"
+    btn_label = f"【{detail_info}】 元の在庫数: {item['元の在庫数']} / 持ち出し中: {item['持ち出し中の在庫数']} / 残り: {item['残りの在庫数']}"
+    if item['予約中の在庫数'] > 0:
+        btn_label += f" / 予約: {item['予約中の在庫数']}"
+    if st.button(btn_label, key=f"btn_{item_key}"):
+        if item['品物ID'] in st.session_state.expanded_items:
+            st.session_state.expanded_items.remove(item['品物ID'])
+        else:
+            st.session_state.expanded_items.add(item['品物ID'])
+    if item['品物ID'] in st.session_state.expanded_items:
+        max_qty = item['残りの在庫数']
+        if max_qty <= 0:
+            st.write("在庫なし")
+        else:
+            qty = st.number_input(f"数量を選択 ({detail_info})", min_value=1, max_value=max_qty, key=f"qty_{item['品物ID']}")
+            if st.button(f"カートに入れる ({detail_info})", key=f"add_cart_{item['品物ID']}"):
+                cart = st.session_state.get('cart', {})
+                cart[item['品物ID']] = cart.get(item['品物ID'], 0) + qty
+                st.session_state.cart = cart
+                st.success(f"{detail_info} をカートに {qty} 個追加しました。")
+
+@st.fragment
+def cart_line(item_id):
+    # 数量変更はカート（session_state）だけを書き換え、ページ全体は再実行しない
+    cart = st.session_state.cart
+    if item_id not in cart:
+        return
+    qty = cart[item_id]
+    item = items_df[items_df['品物ID'] == item_id]
+    if item.empty:
+        st.write(f"品物ID {item_id} は在庫リストに存在しません。")
+        return
+    item_name = item.iloc[0]['品物名']
+    detail = item.iloc[0].get('詳細', '')
+    if service.multi:
+        detail = f"{item.iloc[0]['倉庫']} / {detail}"
+    max_qty = max(int(item.iloc[0]['残りの在庫数']), qty)
+    slot = st.empty()
+    new_qty = slot.number_input(
+        f"{item_name}（詳細: {detail}）",
+        min_value=0, max_value=max_qty, value=qty, step=1,
+        key=f"cart_qty_{item_id}"
+    )
+    if new_qty != qty:
+        if new_qty == 0:
+            cart.pop(item_id, None)
+            slot.empty()
+        else:
+            cart[item_id] = new_qty
+
+def show_bulk_entry():
+    st.title("📥 まとめて入力")
+    st.caption("1 行に「品物ID 数量」を入力します（区切りは空白・カンマ・タブ）。数量を省いた行は 1 個として数え、同じ品物ID の行は合算します。バーコードリーダーで続けて読み取っても入力できます。")
+    text = st.text_area("品物ID と数量", height=240, key="bulk_entry_text")
+    if st.button("🛒 まとめてカートに入れる", key="bulk_entry_button"):
+        cart = st.session_state.get('cart', {})
+        result = service.resolve_bulk_entry(text, cart)
+        if not result.problems.empty:
+            # 1 行でも問題があればカートには入れず、問題のある行をまとめて表示する
+            st.error(f"{len(result.problems)} 行に問題があるため、カートに入れませんでした。直してからもう一度押してください。")
+            st.dataframe(result.problems, hide_index=True)
+        elif not result.additions:
+            st.warning("入力がありません。")
+        else:
+            for item_id, qty in result.additions.items():
+                cart[item_id] = cart.get(item_id, 0) + qty
+                st.session_state.pop(f"cart_qty_{item_id}", None)
+            st.session_state.cart = cart
+            st.session_state.cart_notice = f"✅ {len(result.additions)} 品目（{sum(result.additions.values())} 個）をカートに入れました。"
+            st.session_state.pop("bulk_entry_text", None)
+            go_to("cart")
+            st.rerun()
+    if st.button("🛒 カートを見る", key="bulk_entry_cart"):
+        go_to("cart")
+        st.rerun()
+    if st.button("🔙 ホームに戻る", key="bulk_entry_home"):
+        go_to("home")
+        st.rerun()
+
+def show_low_stock():
+    st.title("📉 在庫の少ない品物")
+    st.caption("残りの在庫数が発注点以下の品物です。不足数 = 発注点 − 残りの在庫数。")
+    low = service.low_stock()
+    if low.empty:
+        st.write("発注点以下の品物はありません。")
+    else:
+        st.dataframe(low, hide_index=True)
+        st.download_button("⬇️ CSV で保存", low.to_csv(index=False).encode('utf-8-sig'),
+                           file_name=f"low_stock_{date.today():%Y%m%d}.csv", mime="text/csv", key="low_stock_csv")
+
+    st.subheader("⚙️ 発注点の設定")
+    labels = dict(zip(items_df['品物ID'], items_df['品物名'] + '（' + items_df['詳細'].fillna('').astype(str) + '）'))
+    item_id = st.selectbox("品物", list(labels), format_func=lambda i: f"{i}: {labels[i]}", key="threshold_item")
+    if item_id is not None:
+        current = service.thresholds().get(str(item_id))
+        st.write(f"今の発注点: {'なし' if current is None else f'{int(current)} 個'}")
+        value = st.number_input("発注点（残りの在庫数がこの数以下になったら知らせる）", min_value=0, step=1,
+                                value=0 if current is None else int(current), key="threshold_value")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("💾 発注点を保存", key="threshold_save"):
+                service.set_thresholds({item_id: int(value)})
+                st.rerun()
+        with col2:
+            if current is not None and st.button("🗑 発注点を外す", key="threshold_clear"):
+                service.set_thresholds({item_id: None})
+                st.rerun()
+
+    if st.button("🔙 ホームに戻る", key="low_stock_home"):
+        go_to("home")
+        st.rerun()
+
 def show_cart():
     st.title("🛒 カート内の品物一覧")
+    if 'cart_notice' in st.session_state:
+        st.warning(st.session_state.pop('cart_notice'))
+    if st.button("📥 ID をまとめて入力", key="cart_bulk_entry"):
+        go_to("bulk_entry")
+        st.rerun()
     cart = st.session_state.get('cart', {})
     if not cart:
         st.write("カートには何も入っていません。")
     else:
-        to_remove = []
-        for item_id, qty in cart.items():
-            item = items_df[items_df['品物ID'] == item_id]
-            if not item.empty:
-                item_name = item.iloc[0]['品物名']
-                detail = item.iloc[0].get('詳細', '')
-                max_qty = item.iloc[0]['残りの在庫数'] + qty
-                new_qty = st.number_input(
-                    f"{item_name}（詳細: {detail}）",
-                    min_value=0, max_value=max_qty, value=qty, step=1,
-                    key=f"cart_qty_{item_id}"
-                )
-                if new_qty != qty:
-                    if new_qty == 0:
-                        to_remove.append(item_id)
-                    else:
-                        cart[item_id] = new_qty
-                    st.session_state.cart = cart
-                    st.rerun()
-            else:
-                st.write(f"品物ID {item_id} は在庫リストに存在しません。")
-        for rem_id in to_remove:
-            cart.pop(rem_id, None)
+        for item_id in list(cart):
+            cart_line(item_id)
         st.session_state.cart = cart
 
         st.markdown("### 🚚 持ち出し情報を入力")
@@ -425,8 +457,21 @@ def show_cart():
         start_date = st.date_input("持ち出し開始日", date.today(), key="cart_start_date")
         end_date = st.date_input("持ち出し終了日", date.today(), key="cart_end_date")
 
+        # 選んだ期間に予約・持ち出しと重ならずに確保できるかを確認する
+        date_ok = end_date >= start_date
+        if not date_ok:
+            st.error("持ち出し終了日は持ち出し開始日以降にしてください。")
+        else:
+            for shortage in service.check_availability(cart, start_date, end_date):
+                name = items_df.loc[items_df['品物ID'] == shortage['品物ID'], '品物名']
+                label = name.iloc[0] if not name.empty else shortage['品物ID']
+                st.warning(f"⚠️ {label}: この期間に確保できるのは {shortage['残り']} 個です（カート {shortage['要求数']} 個）")
+
         if st.button("✅ 持ち出しを確定", key="cart_confirm_button"):
-            add_checkout_log(cart, destination, borrower, start_date, end_date)
+            if not cart:
+                st.warning("カートが空です。")
+            elif date_ok:
+                add_checkout_log(cart, destination, borrower, start_date, end_date)
     if st.button("🔙 ホームに戻る", key="cart_back_home_button2"):
         go_to("home")
         st.rerun()
@@ -449,24 +494,111 @@ def show_cart():
         st.rerun()
 
 
+def submission_key(name):
+    # 送信ボタンごとのキー。成功するまで同じキーを使うので、ダブルクリックや再実行で二重に書き込まれない
+    if name not in st.session_state:
+        st.session_state[name] = uuid.uuid4().hex
+    return st.session_state[name]
+
 def add_checkout_log(cart, destination, borrower, start_date, end_date):
-    spreadsheet = gc.open(SPREADSHEET_NAME)
-    log_ws = spreadsheet.worksheet("CheckoutLog")
-    existing = log_ws.get_all_records()
-    next_id = len(existing) + 1
-    new_rows = []
-    for item_id, qty in cart.items():
-        item_row = items_df[items_df['品物ID'] == item_id].iloc[0]
-        item_name = item_row['品物名']
-        new_rows.append([
-            next_id, item_id, item_name, qty, destination, borrower,
-            start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), "FALSE"])
-        next_id += 1
-    log_ws.append_rows(new_rows)
+    try:
+        service.checkout(cart, destination, borrower, start_date, end_date,
+                         idempotency_key=submission_key("checkout_key"))
+    except StockConflictError as e:
+        # 他の人が先に持ち出した分だけカートを減らし、確認してもらってから再度確定する
+        for shortage in e.shortages:
+            item_id = shortage['品物ID']
+            if shortage['残り'] > 0:
+                cart[item_id] = shortage['残り']
+            else:
+                cart.pop(item_id, None)
+            st.session_state.pop(f"cart_qty_{item_id}", None)
+        st.session_state.cart = cart
+        st.session_state.cart_notice = f"⚠️ {e} カートの数量を残り数に合わせました。内容を確認して再度確定してください。"
+        st.rerun()
     st.session_state.cart = {}
+    st.session_state.pop("checkout_key", None)
     st.success("持ち出し処理が完了しました。")
     st.rerun()
 
+def show_analytics():
+    st.title("📊 延滞・稼働率の分析")
+    report = service.analytics()
+
+    st.subheader(f"⏰ 持ち出し終了日を過ぎている持ち出し（{len(report.overdue)}件）")
+    if report.overdue.empty:
+        st.write("延滞している持ち出しはありません。")
+    else:
+        st.dataframe(report.overdue, hide_index=True)
+
+    st.subheader("📈 品物ごとの稼働率")
+    st.caption("稼働率 = 延べ持ち出し日数 ÷（元の在庫数 × 記録開始からの日数）")
+    st.dataframe(report.utilization, hide_index=True)
+
+    st.subheader("🏗 持ち出し数の多い現場")
+    if not report.top_sites.empty:
+        st.bar_chart(report.top_sites.set_index('持ち出し先')['持ち出し数合計'])
+        st.dataframe(report.top_sites, hide_index=True)
+
+    st.subheader("🧠 メモリ使用量")
+    shared = service.shared_memory()
+    sessions = service.session_memory()
+    st.write(f"全セッション共有の表: {format_bytes(sum(shared.values()))}（品物 {format_bytes(shared['items'])} / "
+             f"持ち出し記録 {format_bytes(shared['checkout'])}）")
+    st.write(f"開いているセッション: {len(sessions)} 件 / セッションごとのデータ合計: {format_bytes(sessions['バイト数'].sum())}")
+    if not sessions.empty:
+        st.dataframe(sessions, hide_index=True)
+
+    if st.button("📜 在庫の履歴を見る"):
+        go_to("stock_history")
+        st.rerun()
+
+    st.subheader("⏱ 表示の計測")
+    runs = st.number_input("計測する表示の回数", min_value=1, max_value=MAX_RUNS, value=3, key="profile_count")
+    st.caption("次の表示から指定回数だけ、ページの処理を cProfile で計測します。URL に ?profile=回数 を付けても始められます。")
+    if st.button("⏱ 計測を始める", key="profile_start"):
+        st.session_state.profile_runs = int(runs)
+        st.session_state.profile_reports = []
+        go_to("home")
+        st.rerun()
+    if st.button("🔙 ホームに戻る"):
+        go_to("home")
+        st.rerun()
+
+def show_stock_history():
+    st.title("📜 在庫の履歴")
+    day = st.date_input("いつの時点の在庫を見るか", value=date.today(), key="history_date")
+    when = pd.Timestamp(day) + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
+    state = service.stock_at(when)
+    if state.empty:
+        st.write("この日より前の記録はありません。")
+    else:
+        st.caption("持ち出し中の在庫数には予約中の分も含みます。")
+        names = items_df.drop_duplicates('品物ID').set_index('品物ID')[['品物名', '詳細']]
+        st.dataframe(state.join(names, on='品物ID')[['品物ID', '品物名', '詳細', '元の在庫数', '持ち出し中の在庫数', '残りの在庫数']],
+                     hide_index=True)
+
+    labels = dict(zip(items_df['品物ID'], items_df['品物名']))
+    item_id = st.selectbox("品物ごとの出来事", list(labels), format_func=lambda i: f"{i}: {labels[i]}",
+                           key="history_item")
+    if item_id is not None:
+        st.dataframe(service.stock_history().item_events(item_id), hide_index=True)
+
+    if st.button("🔙 分析に戻る"):
+        go_to("analytics")
+        st.rerun()
+
+STATUS_PAGE_SIZE = 20
+STATUS_SORTS = {
+    "終了日が近い順": ('終了日', True),
+    "開始日が新しい順": ('開始日', False),
+    "現場名順": ('持ち出し先', True),
+    "件数が多い順": ('件数', False),
+}
+
+def format_day(value):
+    return value.strftime('%Y-%m-%d') if pd.notna(value) else '未定'
+
 def show_checkout_status():
     st.markdown("""
     <style>
@@ -484,24 +616,86 @@ def show_checkout_status():
     """, unsafe_allow_html=True)
 
     st.title("🚚 持ち出し中（現場単位）")
-    active_checkout = checkout_df[checkout_df['返却済み（TRUE/FALSE）'].astype(str).str.upper() != 'TRUE']
-    if active_checkout.empty:
+    if st.button("📦 まとめて返却（複数の現場・ログID指定）", key="bulk_return_nav"):
+        go_to("bulk_return")
+        st.rerun()
+    all_groups = service.checkout_groups()
+    if all_groups.empty:
         st.write("現在、持ち出し中の品物はありません。")
     else:
-        groups = active_checkout.groupby(['持ち出し先', '持ち出し者'])
-        for (destination, person), group in groups:
-            btn_label = f"現場名: {destination} / 持って行った人: {person}"
+        # 絞り込み・並べ替えは集計済みの (現場, 持ち出し者) の表に対してまとめて行い、1 ページ分だけ表示する
+        with st.expander("🔎 絞り込み・並べ替え"):
+            sites = st.multiselect("持ち出し先", sorted(all_groups['持ち出し先'].astype(str).unique()), key="status_sites")
+            people = st.multiselect("持ち出し者", sorted(all_groups['持ち出し者'].astype(str).unique()), key="status_people")
+            overdue_only = st.checkbox("⏰ 終了日を過ぎているものだけ", key="status_overdue")
+            start = end = None
+            if st.checkbox("持ち出し開始日で絞り込む", key="status_use_dates"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    start = st.date_input("この日から", date.today(), key="status_start")
+                with col2:
+                    end = st.date_input("この日まで", date.today(), key="status_end")
+            sort_label = st.selectbox("並べ替え", list(STATUS_SORTS), key="status_sort")
+        sort, ascending = STATUS_SORTS[sort_label]
+        groups = service.checkout_groups(sites=sites, people=people, overdue_only=overdue_only,
+                                         start=start, end=end, sort=sort, ascending=ascending)
+
+        # 条件を変えたら 1 ページ目に戻す
+        filters = (tuple(sites), tuple(people), overdue_only, start, end, sort_label)
+        if st.session_state.get('status_filters') != filters:
+            st.session_state.status_filters = filters
+            st.session_state.status_page = 0
+        pages = max(1, -(-len(groups) // STATUS_PAGE_SIZE))
+        page_no = min(st.session_state.get('status_page', 0), pages - 1)
+        st.caption(f"{len(groups)} 件中 {page_no * STATUS_PAGE_SIZE + 1 if len(groups) else 0}〜"
+                   f"{min((page_no + 1) * STATUS_PAGE_SIZE, len(groups))} 件（{page_no + 1}/{pages} ページ）")
+
+        for group in groups.iloc[page_no * STATUS_PAGE_SIZE:(page_no + 1) * STATUS_PAGE_SIZE].itertuples(index=False):
+            destination, person = group.持ち出し先, group.持ち出し者
+            btn_label = f"{'⏰ ' if group.延滞 else ''}現場名: {destination} / 持って行った人: {person}"
             if st.button(btn_label, key=f"btn_{destination}_{person}"):
                 go_to("return_detail", destination=destination, person=person)
                 st.rerun()
-            st.write(f"開始日: {group['持ち出し開始日'].min()} / 終了日: {group['持ち出し終了日'].max()}")
+            st.write(f"開始日: {format_day(group.開始日)} / 終了日: {format_day(group.終了日)} / {group.件数} 件・{group.持ち出し数} 個")
             st.markdown("---")
+
+        if pages > 1:
+            col1, col2 = st.columns(2)
+            with col1:
+                if page_no > 0 and st.button("◀ 前のページ", key="status_prev"):
+                    st.session_state.status_page = page_no - 1
+                    st.rerun()
+            with col2:
+                if page_no < pages - 1 and st.button("次のページ ▶", key="status_next"):
+                    st.session_state.status_page = page_no + 1
+                    st.rerun()
     if st.button("🔙 ホームに戻る"):
         go_to("home")
         st.rerun()
 
 
 
+@st.fragment
+def return_line(row):
+    # チェック・数量入力の結果は return_selection に貯め、返却ボタンでまとめて使う
+    log_id = row['ログID']
+    item_name = row['品物名']
+    item_info = items_df[items_df['品物ID'] == row['品物ID']]
+    detail = item_info.iloc[0]['詳細'] if not item_info.empty else ''
+    default_qty = int(row['持ち出し数'])
+    selection = st.session_state.return_selection
+    checked = st.checkbox(f"{item_name} / {detail} / 数量: {default_qty}", key=f"return_checkbox_{log_id}")
+    if not checked:
+        selection.pop(log_id, None)
+        return
+    qty = st.number_input(f"返却数量（{item_name}）", min_value=0, max_value=default_qty, value=default_qty, key=f"qty_{log_id}")
+    damaged = st.checkbox("破損したものがあるか", key=f"damaged_checkbox_{log_id}")
+    damaged_qty = 0
+    if damaged:
+        st.caption("※返却数量を設定後、破損数量を入力しないとダメです。（借りた数量＞返却数量≧破損数量。一部返却できるので借りた数量＝返却数量＋破損数量でなくてOK。）")
+        damaged_qty = st.number_input(f"破損・滅失数量（{item_name}）", min_value=0, max_value=default_qty - qty, value=0, key=f"damaged_qty_{log_id}")
+    selection[log_id] = {"返却数量": qty, "破損数量": damaged_qty, "品物ID": row['品物ID']}
+
 def show_return_detail():
     destination = st.session_state.page_params.get('destination')
     person = st.session_state.page_params.get('person')
@@ -516,22 +710,12 @@ def show_return_detail():
     if target.empty:
         st.write("返却待ちのアイテムはありません。")
     else:
-        return_items = {}
+        if 'return_selection' not in st.session_state:
+            st.session_state.return_selection = {}
         for _, row in target.iterrows():
-            log_id = row['ログID']
-            item_name = row['品物名']
-            item_info = items_df[items_df['品物ID'] == row['品物ID']]
-            detail = item_info.iloc[0]['詳細'] if not item_info.empty else ''
-            default_qty = int(row['持ち出し数'])
-            checked = st.checkbox(f"{item_name} / {detail} / 数量: {default_qty}", key=f"return_checkbox_{log_id}")
-            if checked:
-                qty = st.number_input(f"返却数量（{item_name}）", min_value=0, max_value=default_qty, value=default_qty, key=f"qty_{log_id}")
-                damaged = st.checkbox("破損したものがあるか", key=f"damaged_checkbox_{log_id}")
-                damaged_qty = 0
-                if damaged:
-                    st.caption("※返却数量を設定後、破損数量を入力しないとダメです。（借りた数量＞返却数量≧破損数量。一部返却できるので借りた数量＝返却数量＋破損数量でなくてOK。）")
-                    damaged_qty = st.number_input(f"破損・滅失数量（{item_name}）", min_value=0, max_value=default_qty - qty, value=0, key=f"damaged_qty_{log_id}")
-                return_items[log_id] = {"返却数量": qty, "破損数量": damaged_qty, "品物ID": row['品物ID']}
+            return_line(row)
+        selection = st.session_state.return_selection
+        return_items = {log_id: selection[log_id] for log_id in target['ログID'] if log_id in selection}
 
         if st.button("✅ 選択したアイテムを返却") and return_items:
             update_checkout_log_after_return(return_items)
@@ -560,28 +744,64 @@ def show_return_detail():
 
 
 
+def show_bulk_return():
+    st.title("📦 まとめて返却")
+    active = checkout_df[checkout_df['返却済み（TRUE/FALSE）'].astype(str).str.upper() != 'TRUE']
+    method = st.radio("返却する持ち出しの選び方", ["条件で絞り込む", "ログIDを貼り付ける"], horizontal=True)
+    if method == "条件で絞り込む":
+        sites = st.multiselect("持ち出し先", sorted(active['持ち出し先'].dropna().astype(str).unique()))
+        people = st.multiselect("持ち出し者", sorted(active['持ち出し者'].dropna().astype(str).unique()))
+        start = end = None
+        if st.checkbox("持ち出し開始日で絞り込む"):
+            col1, col2 = st.columns(2)
+            with col1:
+                start = st.date_input("この日から", date.today(), key="bulk_return_start")
+            with col2:
+                end = st.date_input("この日まで", date.today(), key="bulk_return_end")
+        target = service.select_returns(sites=sites, people=people, start=start, end=end)
+    else:
+        pasted = st.text_area("ログID（改行・スペース・カンマ区切り）", key="bulk_return_ids")
+        log_ids = [i for i in re.split(r'[\s,、]+', pasted) if i]
+        # 複数倉庫のときも、どの倉庫でも重ならないログID はシートの番号のままで指定できる
+        resolved, ambiguous = service.resolve_log_ids(log_ids)
+        target = service.select_returns(log_ids=resolved)
+        missing = sorted(set(resolved) - set(target['ログID'].astype(str)))
+        if ambiguous:
+            st.warning(f"複数の倉庫にあるログID です（倉庫:ログID の形で指定してください）: {', '.join(ambiguous)}")
+        if missing:
+            st.warning(f"持ち出し中ではないログID: {', '.join(missing)}")
+
+    if target.empty:
+        st.write("対象の持ち出しはありません。")
+    else:
+        columns = ['ログID', '品物名', '持ち出し数', '持ち出し先', '持ち出し者', '持ち出し開始日', '持ち出し終了日']
+        edited = st.data_editor(
+            target[columns].assign(返却数量=target['持ち出し数'], 破損数量=0),
+            disabled=columns, hide_index=True, key="bulk_return_editor"
+        )
+        st.caption(f"{len(edited)} 行 / 返却 {int(edited['返却数量'].sum())} 個 / 破損・滅失 {int(edited['破損数量'].sum())} 個")
+        if st.button("✅ まとめて返却", key="bulk_return_button"):
+            update_checkout_log_after_return({
+                row['ログID']: {"返却数量": int(row['返却数量']), "破損数量": int(row['破損数量'])}
+                for row in edited.to_dict('records')
+            })
+            return
+
+    if st.button("🔙 持ち出し中確認に戻る"):
+        go_to("checkout_status")
+        st.rerun()
+
 def update_checkout_log_after_return(return_items):
-    spreadsheet = gc.open(SPREADSHEET_NAME)
-    items_ws = spreadsheet.worksheet("Items")
-    checkout_ws = spreadsheet.worksheet("CheckoutLog")
-    for log_id, data in return_items.items():
-        qty = data["返却数量"]
-        damaged_qty = data["破損数量"]
-        item_id = data["品物ID"]
-        checkout_log = checkout_df[checkout_df['ログID'] == log_id]
-        if not checkout_log.empty:
-            idx = checkout_log.index[0]
-            checkout_df.at[idx, '返却済み（TRUE/FALSE）'] = 'TRUE'
-            checkout_df.at[idx, '返却数量'] = qty
-            checkout_ws.update_cell(idx + 2, checkout_log.columns.get_loc('返却済み（TRUE/FALSE）') + 1, 'TRUE')
-            checkout_ws.update_cell(idx + 2, checkout_log.columns.get_loc('返却数量') + 1, qty)
-        item_row = items_df[items_df['品物ID'] == item_id]
-        if not item_row.empty and damaged_qty > 0:
-            item_idx = item_row.index[0]
-            current_stock = int(items_df.at[item_idx, '元の在庫数'])
-            new_stock = max(0, current_stock - damaged_qty)
-            items_df.at[item_idx, '元の在庫数'] = new_stock
-            items_ws.update_cell(item_idx + 2, items_df.columns.get_loc('元の在庫数') + 1, new_stock)
+    # 全行を確認してから 1 回でまとめて書き込む（1 行でも不正なら何も書き込まない）
+    try:
+        service.return_items(return_items, idempotency_key=submission_key("return_key"))
+    except ReturnValidationError as e:
+        st.error("返却できない行があったため、返却処理を行いませんでした。")
+        for problem in e.problems:
+            st.write(f"・{problem}")
+        return
+    st.session_state.pop('return_selection', None)
+    st.session_state.pop('return_key', None)
     st.success("返却処理を完了しました！")
     go_to("home")
     st.rerun()
@@ -600,43 +820,88 @@ if 'page_params' not in st.session_state:
     st.session_state.page_params = {}
 if 'search_triggered' not in st.session_state:
     st.session_state.search_triggered = False
-
-if 'items_df' not in st.session_state:
-    items_df, checkout_df, list_df, favorite_df = load_sheet_data()
-    items_df = calculate_remaining_stock(items_df, checkout_df)
-    st.session_state.items_df = items_df
-    st.session_state.checkout_df = checkout_df
-    st.session_state.list_df = list_df
-    st.session_state.favorite_df = favorite_df  # ✅追加
-else:
-    items_df = st.session_state.items_df
-    checkout_df = st.session_state.checkout_df
-    list_df = st.session_state.list_df
-    favorite_df = st.session_state.favorite_df  # ✅追加
-
-
+if 'profile_runs' not in st.session_state:
+    st.session_state.profile_runs = 0
+    st.session_state.profile_reports = []
+
+# --- 表はセッションに持たせず、全セッション共有のスナップショット（読み取り専用）をそのまま参照する ---
+snapshot = service.snapshot()
+items_df = snapshot.items
+checkout_df = snapshot.checkout
+list_df = snapshot.lists
+favorite_df = snapshot.favorites
+ctx = get_script_run_ctx()
+if ctx is not None:
+    service.note_session_memory(ctx.session_id, session_memory())
+
+stale_warehouses = snapshot.stale_warehouses
+if stale_warehouses:
+    st.warning(f"⚠️ {', '.join(stale_warehouses)} の読み込みが間に合わなかったため、前回読み込んだ内容を表示しています。")
 
 # --- ページルーティング ---
-page = st.session_state.page
-if page == 'home':
-    show_home()
-elif page == 'list':
-    show_list()
-elif page == 'list_detail':
-    show_list_detail()
-elif page == 'checkout_status':
-    show_checkout_status()
-elif page == 'cart':
-    show_cart()
-elif page == 'favorites':
-    show_favorites()
-elif page == 'favorites_detail':
-    show_favorites_detail()
-elif page == "favorite_use":
-    show_favorite_use()
-elif page == "return_detail":
-    show_return_detail()
+def route_page(page):
+    if page == 'home':
+        show_home()
+    elif page == 'list':
+        show_list()
+    elif page == 'list_detail':
+        show_list_detail()
+    elif page == 'checkout_status':
+        show_checkout_status()
+    elif page == 'cart':
+        show_cart()
+    elif page == 'favorites':
+        show_favorites()
+    elif page == 'favorites_detail':
+        show_favorites_detail()
+    elif page == "favorite_use":
+        show_favorite_use()
+    elif page == "return_detail":
+        show_return_detail()
+    elif page == "bulk_return":
+        show_bulk_return()
+    elif page == "analytics":
+        show_analytics()
+    elif page == "stock_history":
+        show_stock_history()
+    elif page == "bulk_entry":
+        show_bulk_entry()
+    elif page == "low_stock":
+        show_low_stock()
 
 
+    else:
+        st.error("無効なページ指定です。")
+
+# --- 計測（?profile=N か分析画面のボタンで、次の N 回の表示を cProfile で計測して上位の関数を表示する）---
+def data_sizes():
+    return {'品物': len(items_df), '持ち出し記録': len(checkout_df), '持ち出し先': len(list_df),
+            'いつものカート': len(favorite_df), 'カート': len(st.session_state.cart),
+            'セッションのバイト数': session_memory()}
+
+def keep_profile(report):
+    st.session_state.profile_runs -= 1
+    st.session_state.profile_reports = ([report] + st.session_state.profile_reports)[:5]
+
+def show_profile_reports():
+    with st.expander(f"⏱ 計測結果（残り {st.session_state.profile_runs} 回）", expanded=True):
+        for report in st.session_state.profile_reports:
+            st.write(f"**{report['ページ']}** {report['秒'] * 1000:.0f}ms — " +
+                     " / ".join(f"{k} {v}" for k, v in report['データ量'].items()))
+            st.caption(report['ファイル'])
+            st.dataframe(report['上位の関数'], hide_index=True)
+
+profile_param = st.query_params.get('profile')
+if profile_param is not None and profile_param.isdigit():
+    # 計測ボタンと同じく 1〜MAX_RUNS 回に収める
+    st.session_state.profile_runs = min(max(int(profile_param), 1), MAX_RUNS)
+    st.session_state.profile_reports = []
+    del st.query_params['profile']
+
+if st.session_state.profile_runs > 0:
+    page = st.session_state.page
+    profile_call(page, data_sizes(), lambda: route_page(page), keep_profile)
 else:
-    st.error("無効なページ指定です。")
\ No newline at end of file
+    route_page(st.session_state.page)
+if st.session_state.profile_reports:
+    show_profile_reports()